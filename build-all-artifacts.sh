@@ -30,6 +30,13 @@ base_csr_dir=${rudb_dir}/spec/std/isa/csr
 
 [ ! -d build ] && mkdir build
 
+# Parsed UDB files are cached across generator invocations and builds.
+export UDB_SPEC_CACHE=build/udb-spec-cache.pickle
+export UDB_DEPS_MANIFEST=build/udb-deps.json
+# KLEE results are cached by the hash of their inputs, point this at a
+# shared directory to reuse them across builds and machines.
+export UDB_KLEE_CACHE=${UDB_KLEE_CACHE:-build/klee-cache}
+
 [ ! -d ${klee_xqci} ] && mkdir -p ${klee_xqci}
 [ ! -d ${klee_xqccmp} ] && mkdir -p ${klee_xqccmp}
 
@@ -37,30 +44,48 @@ echo "Building helper-to-tcg:"
 sh build-helper-to-tcg.sh $llvm_config
 
 echo "Generating:"
-echo "  - helper-to-tcg cpp input for Xqci"
-./scripts/udb-to-cpp.py \
+./scripts/udb-gen.py --jobs "$(nproc)" --referenced-csrs-only \
+    --name xqci \
+    --cpp-shards "$(nproc)" \
     --csrs "${xqci_csr_dir},${smrnmi_csr_dir},${base_csr_dir}" \
+    --csr-dir ${xqci_csr_dir} \
     --inst-dir ${xqci_inst_dir} \
-    -o build/xqci.cpp 
+    --disas-sizes "16,32,48" \
+    --artifacts cpp,csr,decodetree,trans,disas \
+    --out-dir build
 
-echo "  - helper-to-tcg cpp input for Xqccmp"
-./scripts/udb-to-cpp.py \
+./scripts/udb-gen.py --jobs "$(nproc)" --referenced-csrs-only \
+    --name xqccmp \
+    --cpp-shards "$(nproc)" \
     --csrs "${base_csr_dir}" \
     --inst-dir ${xqccmp_inst_dir} \
-    -o build/xqccmp.cpp 
-
-echo "Building CSR fields for Xqci"
-./scripts/udb-to-csr.py \
-    --inst-dir=${xqci_inst_dir} \
-    --csr-dir=${xqci_csr_dir} \
-    --out-c=build/xqci-csr.c \
-    --out-h=build/xqci-csr.h \
-    --name=xqci
+    --disas-sizes "16" \
+    --artifacts cpp,decodetree,trans,disas \
+    --out-dir build
+
+# The helper-to-tcg input is split into shards which are compiled in
+# parallel and then joined into a single module. Functions defined in the
+# shared cpp-templates headers end up in every shard, their identical copies
+# are merged via --override.
+compile_shards() {
+    ls build/$1-shard-*.cpp | xargs -P "$(nproc)" -n 1 \
+        sh -c '"$0" "$1" -emit-llvm -std=c++20 -c -O3 -I cpp-templates -I include -o "${1%.cpp}.bc"' "$clangpp"
+    link_args=""
+    for f in build/$1-shard-*.cpp; do
+        bc=${f%.cpp}.bc
+        if [ -z "${link_args}" ]; then
+            link_args=${bc}
+        else
+            link_args="${link_args} --override=${bc}"
+        fi
+    done
+    $($llvm_config --bindir)/llvm-link ${link_args} -o build/$1.ll
+}
 
 echo "Compiling helper-to-tcg input -> .ll for Xqci"
-$clangpp build/xqci.cpp -emit-llvm -std=c++20 -c -O3 -I cpp-templates -I include -o build/xqci.ll
+compile_shards xqci
 echo "Compiling helper-to-tcg input -> .ll for Xqccmp"
-$clangpp build/xqccmp.cpp -emit-llvm -std=c++20 -c -O3 -I cpp-templates -I include -o build/xqccmp.ll
+compile_shards xqccmp
 
 echo "Running helper-to-tcg for Xqci"
 ./build/helper-to-tcg build/xqci.ll \
@@ -91,60 +116,39 @@ echo "Running helper-to-tcg for Xqccmp"
     &> build/helper-to-tcg-out-xqccmp
 
 echo "Generating KLEE input:"
-./scripts/udb-to-klee.py \
+./scripts/udb-gen.py --jobs "$(nproc)" --referenced-csrs-only \
+    --name xqci \
     --csrs "${xqci_csr_dir},${smrnmi_csr_dir},${base_csr_dir}" \
     --inst-dir ${xqci_inst_dir} \
     --helper-to-tcg-translated build/xqci-tcg.h \
-    --out ${klee_xqci}
+    --artifacts klee \
+    --klee-out ${klee_xqci}
 
-./scripts/udb-to-klee.py \
+./scripts/udb-gen.py --jobs "$(nproc)" --referenced-csrs-only \
+    --name xqccmp \
     --csrs "${base_csr_dir}" \
     --inst-dir ${xqccmp_inst_dir} \
     --helper-to-tcg-translated build/xqccmp-tcg.h \
-    --out ${klee_xqccmp}
-
-echo "Generating QEMU decodetree input:"
-./scripts/udb-to-decodetree.py \
-    --inst-dir ${xqci_inst_dir} \
-    --out build/xqci \
-
-./scripts/udb-to-decodetree.py \
-    --inst-dir ${xqccmp_inst_dir} \
-    --out build/xqccmp
-
-echo "Generating QEMU decodetree translation functions"
-./scripts/udb-to-trans.py \
-    --inst-dir ${xqci_inst_dir} \
-    --out-decode build/xqci-trans-decode.c.inc \
-    --out-disas build/riscv-xqci-trans-disas.c.inc
-
-./scripts/udb-to-trans.py \
-    --inst-dir ${xqccmp_inst_dir} \
-    --out-decode build/xqccmp-trans-decode.c.inc \
-    --out-disas build/riscv-xqccmp-trans-disas.c.inc
-
-echo "Generating QEMU disas glue files"
-./scripts/udb-to-disas.py \
-    --inst-dir ${xqci_inst_dir} \
-    --disas-name xqci \
-    --disas-sizes "16,32,48" \
-    --trans-disas riscv-xqci-trans-disas.c.inc \
-    --out-c build/riscv-xqci.c \
-    --out-h build/riscv-xqci.h
-
-./scripts/udb-to-disas.py \
-    --inst-dir ${xqccmp_inst_dir} \
-    --disas-name xqccmp \
-    --disas-sizes "16" \
-    --trans-disas riscv-xqccmp-trans-disas.c.inc \
-    --out-c build/riscv-xqccmp.c \
-    --out-h build/riscv-xqccmp.h
+    --artifacts klee \
+    --klee-out ${klee_xqccmp}
 
 #echo "Running klee"
 sh build-tests.sh $clangpp $klee ${klee_xqci}
 sh build-tests.sh $clangpp $klee build/klee/xqccmp
 
-./scripts/decodetree-disas.py --static-decode='decode_xqci_16_impl' build/xqci-16.decode --insnwidth=16 > build/riscv-xqci-16-decode.c.inc
-./scripts/decodetree-disas.py --static-decode='decode_xqci_32_impl' build/xqci-32.decode --insnwidth=32 > build/riscv-xqci-32-decode.c.inc
-./scripts/decodetree-disas.py --static-decode='decode_xqci_48_impl' build/xqci-48.decode --varinsnwidth=64 > build/riscv-xqci-48-decode.c.inc
-./scripts/decodetree-disas.py --static-decode='decode_xqccmp_16_impl' build/xqccmp-16.decode --insnwidth=16 > build/riscv-xqccmp-16-decode.c.inc
+# Optionally order the decoders for an instruction frequency profile, e.g.
+# the log of a qemu -d in_asm run.
+decode_opts=""
+if [ -n "${UDB_DECODE_PROFILE}" ]; then
+    decode_opts="--optimize-tree --profile=${UDB_DECODE_PROFILE}"
+fi
+
+# All decoders are generated by a single decodetree-disas.py process, one
+# job per line of the manifest.
+cat > build/decode-manifest <<EOF
+--static-decode=decode_xqci_16_impl --stats=build/xqci-16-decode-stats.json build/xqci-16.decode --insnwidth=16 -o build/riscv-xqci-16-decode.c.inc
+--static-decode=decode_xqci_32_impl --stats=build/xqci-32-decode-stats.json build/xqci-32.decode --insnwidth=32 -o build/riscv-xqci-32-decode.c.inc
+--static-decode=decode_xqci_48_impl --stats=build/xqci-48-decode-stats.json build/xqci-48.decode --varinsnwidth=64 -o build/riscv-xqci-48-decode.c.inc
+--static-decode=decode_xqccmp_16_impl --stats=build/xqccmp-16-decode-stats.json build/xqccmp-16.decode --insnwidth=16 -o build/riscv-xqccmp-16-decode.c.inc
+EOF
+./scripts/decodetree-disas.py ${decode_opts} --jobs "$(nproc)" --manifest=build/decode-manifest
@@ -16,39 +16,7 @@ clangpp=$1
 klee=$2
 dir=$3
 
-klee_bc_dir=${dir}/bc
-klee_out_dir=${dir}/out
-klee_exes_dir=${dir}/exes
-klee_io_dir=${dir}/io
-
-[ ! -d ${klee_bc_dir} ] && mkdir ${klee_bc_dir}
-[ ! -d ${klee_out_dir} ] && mkdir ${klee_out_dir}
-[ ! -d ${klee_exes_dir} ] && mkdir ${klee_exes_dir}
-[ ! -d ${klee_io_dir} ] && mkdir ${klee_io_dir}
-
-for file in ${dir}/*.cpp; do
-    no_ext=${file%.*}
-    basename=${no_ext##*/}
-
-    echo "  ${basename}"
-    echo "    - Compiling klee .cpp input -> .bc"
-    $clangpp $file -std=c++20 -emit-llvm -c -g -O0 -Xclang -disable-O0-optnone -I cpp-templates -I include -I build -o ${klee_bc_dir}/${basename}.bc
-
-    echo "    - Running klee"
-    $klee --external-calls=all \
-          --only-output-states-covering-new \
-          --libc=uclibc \
-          --posix-runtime \
-          --output-dir=${klee_out_dir}/${basename} \
-          ${klee_bc_dir}/${basename}.bc \
-          &> ${dir}/klee-out
-
-    echo "    - Compiling test executable"
-    $clangpp $file -std=c++20 -g -lkleeRuntest -I cpp-templates -I include -I build -o ${klee_exes_dir}/${basename}
-
-    for test in ${klee_out_dir}/${basename}/*.ktest; do
-        echo "    - Collecting test ${test}"
-        KTEST_FILE=$test ./${klee_exes_dir}/${basename} >> ${klee_io_dir}/${basename}
-    done
-done
-
+# Instructions are processed in parallel by scripts/klee-tests.py, per
+# instruction logs are written to ${dir}/logs.
+./scripts/klee-tests.py --clangpp $clangpp --klee $klee --jobs "$(nproc)" \
+    --budgets klee-budgets.yaml ${dir}
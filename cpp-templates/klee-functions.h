@@ -15,6 +15,7 @@
 
 #include <assert.h>
 #include <stdint.h>
+#include <stdio.h>
 #include <unordered_map>
 
 #include "base-structs.h"
@@ -93,6 +94,21 @@ template <> XReg read_memory<32>(XReg va, uint32_t encoding) {
     return rmemory[va.value()].value;
 }
 
+// Prints the memory operations OPS as a JSON list, null if there are none.
+static void print_memory_ops(const std::unordered_map<uint32_t, MemoryOp> &ops) {
+    if (ops.empty()) {
+        printf("null");
+        return;
+    }
+    const char *separator = "[";
+    for (auto &P : ops) {
+        printf("%s{\"address\": %u, \"value\": %u, \"size\": %u}", separator,
+               P.first, P.second.value, P.second.size);
+        separator = ", ";
+    }
+    printf("]");
+}
+
 uint64_t xqci_current_pc() { return 0; }
 
 void xqci_jump_pcrel(int imm) {
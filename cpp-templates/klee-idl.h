@@ -20,3 +20,4 @@
 #include "base-structs.h"
 #include "klee-functions.h"
 #include "klee-operators.h"
+#include "klee-replay.h"
@@ -0,0 +1,155 @@
+//
+// Replay of all tests found by KLEE for an instruction in a single process.
+// Used when the KLEE input is compiled into a test executable with
+// KLEE_REPLAY defined, otherwise symbolic values are created by KLEE.
+//
+// Copyright (c) 2025 rev.ng Labs Srl.
+//
+// This work is licensed under the terms of the GNU GPL, version 2 or
+// (at your option) any later version.
+//
+// See the LICENSE file in the top-level directory for details.
+//
+
+#pragma once
+
+#ifdef KLEE_REPLAY
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include <algorithm>
+#include <filesystem>
+#include <string>
+#include <vector>
+
+#include "base-operators.h"
+#include "klee-functions.h"
+
+// The part of the KTest API (klee/ADT/KTest.h) provided by libkleeRuntest,
+// the header itself is not installed by KLEE.
+extern "C" {
+struct KTestObject {
+    char *name;
+    unsigned numBytes;
+    unsigned char *bytes;
+};
+
+struct KTest {
+    unsigned version;
+    unsigned numArgs;
+    char **args;
+    unsigned symArgvs;
+    unsigned symArgvLen;
+    unsigned numObjects;
+    KTestObject *objects;
+};
+
+KTest *kTest_fromFile(const char *path);
+void kTest_free(KTest *test);
+}
+
+// Version of the test vector format, see common.read_test_vectors().
+#define TEST_VECTOR_VERSION 1
+
+static KTest *replay_test = nullptr;
+static const char *replay_path = nullptr;
+
+// Fills in the symbolic value NAME from the test currently replayed.
+static void make_symbolic(void *addr, size_t size, const char *name) {
+    for (unsigned i = 0; i < replay_test->numObjects; ++i) {
+        KTestObject *object = &replay_test->objects[i];
+        if (strcmp(object->name, name) != 0) {
+            continue;
+        }
+        if (object->numBytes != size) {
+            fprintf(stderr, "%s: size of %s is %u, expected %zu\n", replay_path,
+                    name, object->numBytes, size);
+            exit(1);
+        }
+        memcpy(addr, object->bytes, size);
+        return;
+    }
+    fprintf(stderr, "%s: no value for %s\n", replay_path, name);
+    exit(1);
+}
+
+// Resets all state a test may have modified outside of CPUArchState.
+static void reset_test_state() {
+    has_jump = false;
+    has_store = false;
+    has_load = false;
+    has_valid_test_jump = false;
+    has_valid_test_memop = false;
+    jump_pc_offset = 0;
+    wmemory.clear();
+    rmemory.clear();
+    number_of_reads = 0;
+    overflow = false;
+    underflow = false;
+}
+
+static void add_ktests(std::vector<std::string> &paths, const char *path) {
+    if (!std::filesystem::is_directory(path)) {
+        paths.push_back(path);
+        return;
+    }
+    std::vector<std::string> ktests;
+    for (auto &entry : std::filesystem::directory_iterator(path)) {
+        if (entry.path().extension() == ".ktest") {
+            ktests.push_back(entry.path().string());
+        }
+    }
+    std::sort(ktests.begin(), ktests.end());
+    paths.insert(paths.end(), ktests.begin(), ktests.end());
+}
+
+//
+// Runs TEST once for every .ktest file given on the command line, where
+// directories stand for the .ktest files they contain, in order. Output is
+// written to stdout or the file following -o, as JSON Lines starting with a
+// header naming INSTRUCTION. Without arguments the single test in KTEST_FILE
+// is replayed, as with libkleeRuntest.
+//
+static int replay_main(int argc, char **argv, void (*test)(),
+                       const char *instruction) {
+    std::vector<std::string> paths;
+    for (int i = 1; i < argc; ++i) {
+        if (strcmp(argv[i], "-o") == 0 && i + 1 < argc) {
+            if (freopen(argv[++i], "w", stdout) == nullptr) {
+                perror(argv[i]);
+                return 1;
+            }
+        } else {
+            add_ktests(paths, argv[i]);
+        }
+    }
+    if (argc == 1 && getenv("KTEST_FILE") != nullptr) {
+        paths.push_back(getenv("KTEST_FILE"));
+    }
+
+    printf("{\"format\": \"udb-test-vectors\", \"version\": %d, "
+           "\"instruction\": \"%s\"}\n",
+           TEST_VECTOR_VERSION, instruction);
+    for (auto &path : paths) {
+        replay_path = path.c_str();
+        replay_test = kTest_fromFile(replay_path);
+        if (replay_test == nullptr) {
+            fprintf(stderr, "%s: unable to read test\n", replay_path);
+            return 1;
+        }
+        reset_test_state();
+        test();
+        // Keep the output of earlier tests should a later one crash.
+        fflush(stdout);
+        kTest_free(replay_test);
+    }
+    return 0;
+}
+
+#else
+
+#define make_symbolic klee_make_symbolic
+
+#endif
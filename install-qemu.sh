@@ -55,3 +55,4 @@ cp -r submodules/riscv-unified-db/spec/custom/isa/qc_iu/inst/Xqccmp/ submodules/
 cp scripts/assemble.py submodules/xqci/tests/tcg/riscv32/
 cp scripts/c.py submodules/xqci/tests/tcg/riscv32/
 cp scripts/common.py submodules/xqci/tests/tcg/riscv32/
+cp scripts/idl.py submodules/xqci/tests/tcg/riscv32/
@@ -50,7 +50,7 @@ class InstPrinter:
         # Manually add encoding for two riscv32 instructions which need to be
         # emitted with different operands in tests.
         try:
-            self.yamls['lw'] = yaml.safe_load(
+            self.yamls['lw'] = common.parse_yaml(
                 """
             encoding:
               match:      -----------------010-----0000011
@@ -65,7 +65,7 @@ class InstPrinter:
                 location: 19-15
             """
             )
-            self.yamls['sw'] = yaml.safe_load(
+            self.yamls['sw'] = common.parse_yaml(
                 """
             encoding:
               match:      -----------------010-----0100011
@@ -79,7 +79,7 @@ class InstPrinter:
                 location: 24-20
             """
             )
-            self.yamls['lui'] = yaml.safe_load(
+            self.yamls['lui'] = common.parse_yaml(
                 """
             encoding:
               match:      -------------------------0110111
@@ -91,7 +91,7 @@ class InstPrinter:
                 not: 0
             """
             )
-            self.yamls['addi'] = yaml.safe_load(
+            self.yamls['addi'] = common.parse_yaml(
                 """
             encoding:
               match:      -----------------000-----0010011
@@ -270,7 +270,7 @@ def main():
     args = parser.parse_args()
 
     printer = InstPrinter(args.inst_dir, args.system_mode)
-    io_yaml = common.load_yaml_or_exit(args.io_file)
+    io_yaml = list(common.read_test_vectors(args.io_file))
     io_var_map = {}
     for test in io_yaml:
         if test_has_variables(test):
@@ -280,7 +280,7 @@ def main():
     if not args.inst_name in printer.yamls:
         printer.load(args.inst_name)
     y = printer.yamls[args.inst_name]
-    op = y['operation()']
+    operands = common.operands(y)
 
     vars = common.variables(y)
     var_map = common.variable_map(y)
@@ -312,7 +312,7 @@ def main():
                 if not 'in' in v:
                     continue
 
-                if common.var_is_imm(op, v['name']):
+                if operands[v['name']].is_imm:
                     inst_args.append(v['in'])
                 else:
                     reg = dst_reg + 1 + i
@@ -323,7 +323,7 @@ def main():
                     if 'in' in v:
                         printer.li(v['in'], reg)
 
-                    if common.var_is_compressed(op, v['name']):
+                    if operands[v['name']].is_compressed:
                         reg -= 8
                     inst_args.append(reg)
         if 'has_jump' in test:
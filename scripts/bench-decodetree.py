@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+#
+# Micro-benchmark of the grouping of overlapping instruction encodings done
+# by udb-to-decodetree.py, over a synthetic spec of random encodings.
+#
+# Copyright (c) 2025 rev.ng Labs Srl.
+#
+# This work is licensed under the terms of the GNU GPL, version 2 or
+# (at your option) any later version.
+#
+# See the LICENSE file in the top-level directory for details.
+#
+
+import argparse
+import importlib.util
+import os
+import random
+import time
+
+
+def synthetic_spec(count, seed):
+    """
+    Return {size: (names, matches)} for COUNT instructions of 16, 32 and 48
+    bits. Every instruction fixes the bits of its RISC-V length encoding
+    and a random subset of the remaining bits, so that some of them
+    overlap.
+    """
+    rng = random.Random(seed)
+    spec = {}
+    for i in range(count):
+        size = rng.choice((16, 32, 48))
+        if size == 16:
+            opcode = rng.choice(('00', '01', '10'))
+        elif size == 32:
+            opcode = f'{rng.randrange(4):02b}{rng.randrange(7):03b}11'
+        else:
+            opcode = '011111'
+        rest = ''.join(rng.choice('0011-') for _ in range(size - len(opcode)))
+        names, matches = spec.setdefault(size, ([], []))
+        names.append(f'insn{i}')
+        matches.append(rest + opcode)
+    return spec
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='bench-decodetree.py',
+        description='Time the grouping of overlapping instruction encodings'
+    )
+    parser.add_argument('-c', '--count', type=int, default=5000,
+                        help='Number of synthetic instructions')
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='Number of passes over all instructions')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the synthetic spec')
+    args = parser.parse_args()
+
+    spec = importlib.util.spec_from_file_location(
+        'udb_to_decodetree',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     'udb-to-decodetree.py'))
+    decodetree = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(decodetree)
+    encodings = synthetic_spec(args.count, args.seed)
+
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        groups = {size: decodetree.overlap_groups(names, matches)
+                  for size, (names, matches) in encodings.items()}
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    overlapping = [g for v in groups.values() for g in v
+                   if isinstance(g, list)]
+    print(f'{args.count} instructions, '
+          f'{sum(len(g) for g in overlapping)} in {len(overlapping)} '
+          f'groups, best of {args.repeat}: {best * 1e3:.2f} ms '
+          f'({best / max(args.count, 1) * 1e6:.1f} us/insn)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+#
+# Micro-benchmark of the IDL -> C++ translation of instruction operations
+# (common.op_to_cpp) over all instructions of an extension.
+#
+# Copyright (c) 2025 rev.ng Labs Srl.
+#
+# This work is licensed under the terms of the GNU GPL, version 2 or
+# (at your option) any later version.
+#
+# See the LICENSE file in the top-level directory for details.
+#
+
+import argparse
+import time
+import common
+import idl
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='bench-op-to-cpp.py',
+        description='Time the translation of UDB instruction operations to C++'
+    )
+    parser.add_argument('--inst-dir', required=True,
+                        help='Path to extensions instruction directory in the UDB')
+    parser.add_argument('--csrs', default='',
+                        help='Comma separated list of CSR directories in the UDB which instruction definitions depend on')
+    parser.add_argument('-n', '--repeat', type=int, default=20,
+                        help='Number of passes over all instructions')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes used to parse UDB files')
+    args = parser.parse_args()
+
+    instructions = common.load_instructions(args.inst_dir, args.jobs)
+    csrs = common.load_csrs([d for d in args.csrs.split(',') if d], args.jobs)
+    ops = [y['operation()'] for y in instructions.values()]
+
+    for for_klee in (False, True):
+        best = None
+        for _ in range(args.repeat):
+            # Measure the translation itself, not hits of the AST caches.
+            idl.parse.cache_clear()
+            idl.to_cpp.cache_clear()
+            start = time.perf_counter()
+            for op in ops:
+                common.op_to_cpp(op, csrs, for_klee)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        target = 'klee' if for_klee else 'cpp'
+        print(f'{target}: {len(ops)} operations, {len(csrs)} CSRs, '
+              f'best of {args.repeat}: {best * 1e3:.2f} ms '
+              f'({best / max(len(ops), 1) * 1e6:.1f} us/op)')
+
+
+if __name__ == '__main__':
+    main()
@@ -229,7 +229,7 @@ def main():
     if args.inst_name in skip_insn:
         return
 
-    io_yaml = common.load_yaml_or_exit(args.io_file)
+    io_yaml = list(common.read_test_vectors(args.io_file))
     io_var_map = {}
     for test in io_yaml:
         if test_has_variables(test):
@@ -249,6 +249,7 @@ def main():
         is_compressed = common.inst_is_compressed(y)
         vars = common.variables(y)
         var_map = common.variable_map(y)
+        operands = common.operands(y)
 
         printer.line('#include <stddef.h>')
         printer.line('#include <stdint.h>')
@@ -297,7 +298,7 @@ def main():
                     variable_order.append(v['name'])
                     var = vars[len(vars)-1-i]
 
-                    if common.var_is_imm(y['operation()'], v['name']):
+                    if operands[v['name']].is_imm:
                         imm = v['in']
                         if args.inst_name in should_sext:
                             imm = sext(int(v['in']), common.var_size(var))
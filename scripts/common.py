@@ -13,6 +13,25 @@ import yaml
 import sys
 import re
 import math
+import os
+import atexit
+import pickle
+import hashlib
+import json
+import io
+import contextlib
+import functools
+import concurrent.futures
+import idl
+
+# Prefer the libyaml backed loader, it is an order of magnitude faster than
+# the pure-Python one on large spec trees.
+try:
+    from yaml import CSafeLoader as YamlLoader
+    yaml_loader_name = 'CSafeLoader (libyaml)'
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+    yaml_loader_name = 'SafeLoader (pure-Python)'
 
 decode_only = {
     'qc.brev32.yaml',
@@ -75,16 +94,74 @@ def ranges_in_location(loc_str):
             yield (int(r), 1)
 
 
+# Operand uses as checked by operation_roles() for operations the IDL
+# parser does not handle.
+re_operand_use = re.compile(r'X\[([A-Za-z_]\w*)(\+8)?\]|'
+                            r'creg2reg\(([A-Za-z_]\w*)(\+8)?\)|'
+                            r'\$signed\(([A-Za-z_]\w*)\)')
+
+
+@functools.lru_cache(maxsize=None)
+def operation_roles(op):
+    """
+    Return a dict from names to the roles they are used in by the operation
+    OP, see idl.operand_roles().
+    """
+    try:
+        return idl.operand_roles(idl.parse(op))
+    except idl.IdlError:
+        pass
+    roles = {}
+    for gpr, gpr8, creg, creg8, signed in re_operand_use.findall(op):
+        if gpr:
+            roles.setdefault(gpr, set()).add('gpr+8' if gpr8 else 'gpr')
+        elif creg:
+            roles.setdefault(creg, set()).add('creg+8' if creg8 else 'creg')
+        else:
+            roles.setdefault(signed, set()).add('signed')
+    return roles
+
+
+class Operand:
+    """
+    Description of the encoding variable VAR of an instruction, from the
+    uses of it in the operation, see operands().
+    """
+
+    def __init__(self, var, roles):
+        self.var = var
+        self.name = var['name']
+        # Registers are indexed into X, directly or through creg2reg().
+        self.is_imm = not roles - {'signed'} and \
+            self.name != 'r1s' and self.name != 'r2s'
+        # Compressed registers are offset by 8.
+        self.is_compressed = 'gpr+8' in roles or 'creg' in roles
+        self.is_signed = 'signed' in roles
+
+
+operand_cache = {}
+
+
+def operands(y):
+    """
+    Return a dict from the names of the encoding variables of instruction Y
+    to their Operand, computed once per instruction.
+    """
+    key = (y['name'], y['operation()'])
+    if key not in operand_cache:
+        roles = operation_roles(y['operation()'])
+        operand_cache[key] = {v['name']: Operand(v, roles.get(v['name'], set()))
+                              for v in variables(y)}
+    return operand_cache[key]
+
+
 def var_is_compressed(op, name):
-    return f'X[{name}+8]' in op or \
-        f'creg2reg({name})' in op
+    roles = operation_roles(op).get(name, set())
+    return 'gpr+8' in roles or 'creg' in roles
 
 
 def var_is_imm(op, name):
-    return f'X[{name}]' not in op and \
-        f'X[{name}+8]' not in op and \
-        f'creg2reg({name})' not in op and \
-        f'creg2reg({name}+8)' not in op and \
+    return not operation_roles(op).get(name, set()) - {'signed'} and \
         name != 'r1s' and name != 'r2s'
 
 
@@ -111,13 +188,362 @@ def variable_map(y):
     return map
 
 
-def load_yaml_or_exit(path):
-    with open(path, 'r') as f:
+class SpecCache:
+    """
+    Persistent cache of parsed UDB YAML files.
+
+    Entries are keyed by absolute path and validated against the file's
+    mtime and size. If those changed the file contents are hashed, and
+    the file is only reparsed if the hash differs as well. The cache is
+    stored as a pickle at the path given by the UDB_SPEC_CACHE environment
+    variable and written back on exit, if not set parsed files are only
+    shared within the current process.
+    """
+
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = self.read_entries()
+        self.dirty = False
+        # Source path of every object returned by load(), and digests of
+        # files hashed but not parsed, both only kept in memory.
+        self.paths = {}
+        self.digests = {}
+
+    def read_entries(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'rb') as f:
+                version, entries = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            return {}
+        return entries if version == self.version else {}
+
+    def refresh(self, path):
+        """
+        Revalidate the entry of PATH. Returns None if it is up to date,
+        otherwise (stat, digest, data) of the file which needs parsing.
+        """
+        key = os.path.abspath(path)
+        st = os.stat(path)
+        entry = self.entries.get(key)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry and entry[2] == digest:
+            self.store(path, st, digest, entry[3])
+            return None
+        return st, digest, data
+
+    def store(self, path, st, digest, y):
+        self.entries[os.path.abspath(path)] = \
+            (st.st_mtime_ns, st.st_size, digest, y)
+        self.dirty = True
+
+    def load(self, path):
+        miss = self.refresh(path)
+        if miss:
+            st, digest, data = miss
+            self.store(path, st, digest, parse_yaml(data))
+        key = os.path.abspath(path)
+        y = self.entries[key][3]
+        self.paths[id(y)] = key
+        return y
+
+    def preload(self, paths, jobs):
+        """
+        Parse all files in PATHS missing from the cache using up to JOBS
+        worker processes. Files failing to parse are left for load() to
+        report.
+        """
+        misses = [(p, m) for p in paths if (m := self.refresh(p))]
+        if jobs <= 1 or len(misses) <= 1:
+            # Not worth a pool, parse the data already read instead of
+            # having load() read and hash the files again.
+            for path, (st, digest, data) in misses:
+                try:
+                    self.store(path, st, digest, parse_yaml(data))
+                except yaml.YAMLError:
+                    pass
+            return
+        jobs = min(jobs, len(misses))
+        chunksize = max(1, len(misses) // (4 * jobs))
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            parsed = pool.map(parse_yaml_file, [p for p, _ in misses],
+                              chunksize=chunksize)
+            for (path, (st, digest, _)), y in zip(misses, parsed):
+                if y is not None:
+                    self.store(path, st, digest, y)
+
+    def digest(self, path):
+        key = os.path.abspath(path)
+        st = os.stat(path)
+        for entry in (self.entries.get(key), self.digests.get(key)):
+            if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                return entry[2]
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self.digests[key] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        # Other generators may have run concurrently, merge with whatever
+        # is on disk so their entries are not lost.
+        entries = self.read_entries()
+        entries.update(self.entries)
+        dir = os.path.dirname(self.path)
+        if dir:
+            os.makedirs(dir, exist_ok=True)
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump((self.version, entries), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+warned_slow_loader = False
+
+
+def parse_yaml(data):
+    """Parse the YAML string or bytes DATA with the fastest available loader."""
+    global warned_slow_loader
+    if YamlLoader is yaml.SafeLoader and not warned_slow_loader:
+        print(f'note: libyaml is not available, using the slower {yaml_loader_name} YAML loader',
+              file=sys.stderr)
+        warned_slow_loader = True
+    return yaml.load(data, Loader=YamlLoader)
+
+
+def parse_yaml_file(path):
+    """Worker of SpecCache.preload(), None is returned on parse errors."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        return parse_yaml(data)
+    except yaml.YAMLError:
+        return None
+
+
+spec_cache = SpecCache(os.environ.get('UDB_SPEC_CACHE'))
+atexit.register(spec_cache.save)
+
+
+def load_yaml(path):
+    return spec_cache.load(path)
+
+
+def spec_path(y):
+    """Return the absolute path of the file Y was loaded from."""
+    return spec_cache.paths[id(y)]
+
+
+def file_digest(path):
+    return spec_cache.digest(path)
+
+
+class DependencyManifest:
+    """
+    Records the input files each generated output was produced from,
+    along with a digest over their contents and any generator parameters
+    affecting the output. Stored as JSON at the path
+    given by the UDB_DEPS_MANIFEST environment variable, if not set no
+    output is ever considered up to date.
+    """
+
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.outputs = self.read_outputs()
+        self.dirty = False
+
+    def read_outputs(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
         try:
-            return yaml.safe_load(f)
-        except yaml.YAMLError as e:
-            print(f'Failed to load yaml file {path}: {e}', file=sys.stderr)
-            exit(1)
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != self.version:
+            return {}
+        return manifest['outputs']
+
+    @staticmethod
+    def inputs_digest(inputs, params):
+        h = hashlib.sha256(repr(params).encode())
+        for i in inputs:
+            h.update(os.path.abspath(i).encode())
+            h.update(file_digest(i).encode())
+        return h.hexdigest()
+
+    def is_up_to_date(self, output, inputs, params=()):
+        if not self.path or not os.path.exists(output):
+            return False
+        entry = self.outputs.get(os.path.abspath(output))
+        return entry is not None and \
+            entry['digest'] == self.inputs_digest(inputs, params)
+
+    def record(self, output, inputs, params=()):
+        if not self.path:
+            return
+        self.outputs[os.path.abspath(output)] = {
+            'inputs': [os.path.abspath(i) for i in inputs],
+            'digest': self.inputs_digest(inputs, params),
+        }
+        self.dirty = True
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        outputs = self.read_outputs()
+        outputs.update(self.outputs)
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': self.version, 'outputs': outputs}, f,
+                      indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+deps = DependencyManifest(os.environ.get('UDB_DEPS_MANIFEST'))
+atexit.register(deps.save)
+
+
+def generator_inputs(script, *specs):
+    """
+    Return the list of files an output of SCRIPT depends on: the script
+    itself, this file, the IDL translation and the source files of all
+    parsed SPECS.
+    """
+    inputs = [script, __file__, idl.__file__]
+    for group in specs:
+        inputs.extend(spec_path(y) for y in group)
+    return inputs
+
+
+def write_if_changed(path, content):
+    """
+    Write CONTENT to PATH unless it already contains exactly that, leaving
+    the mtime of unchanged outputs alone. Returns True if PATH was written.
+    """
+    try:
+        with open(path, 'r') as f:
+            if f.read() == content:
+                return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    with open(path, 'w') as f:
+        f.write(content)
+    return True
+
+
+@contextlib.contextmanager
+def open_output(path):
+    """Like open(PATH, 'w'), but only touches PATH if the contents differ."""
+    out = io.StringIO()
+    yield out
+    write_if_changed(path, out.getvalue())
+
+
+def load_yaml_or_exit(path):
+    try:
+        return load_yaml(path)
+    except yaml.YAMLError as e:
+        print(f'Failed to load yaml file {path}: {e}', file=sys.stderr)
+        exit(1)
+
+
+# Format of the test vectors written by the KLEE test replay, see
+# cpp-templates/klee-replay.h.
+test_vector_format = 'udb-test-vectors'
+test_vector_version = 1
+
+
+def read_test_vectors(path):
+    """
+    Yield the tests of the KLEE io file PATH one at a time. Files are JSON
+    Lines, one test per line after a header naming the format version.
+    Older YAML io files are still accepted, but are loaded as a whole.
+    """
+    with open(path, 'rb') as f:
+        header = f.readline()
+        if header.lstrip().startswith(b'{'):
+            header = json.loads(header)
+            if header.get('format') != test_vector_format or \
+               header.get('version', 0) > test_vector_version:
+                print(f'Unsupported test vector file {path}: {header}',
+                      file=sys.stderr)
+                exit(1)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+    yield from load_yaml_or_exit(path) or []
+
+
+def yaml_files(dir):
+    return [os.path.join(dir, file) for file in sorted(os.listdir(dir))
+            if file.endswith('.yaml')]
+
+
+def load_yaml_files(paths, jobs=1):
+    """
+    Load PATHS, returned in the same order. Files not already in the spec
+    cache are parsed in parallel by up to JOBS processes.
+    """
+    spec_cache.preload(paths, jobs)
+    return [load_yaml_or_exit(p) for p in paths]
+
+
+def load_instructions(inst_dir, jobs=1):
+    """Return a map of file name -> parsed instruction, sorted by file name."""
+    paths = yaml_files(inst_dir)
+    return {os.path.basename(p): y
+            for p, y in zip(paths, load_yaml_files(paths, jobs))}
+
+
+def load_csrs(dirs, jobs=1):
+    """Return a map of CSR name -> parsed CSR for all CSRs in DIRS."""
+    paths = [p for dir in dirs for p in yaml_files(dir)]
+    return {y['name']: y for y in load_yaml_files(paths, jobs)}
+
+
+def referenced_csrs(instructions):
+    """Return the names of CSRs accessed by name in INSTRUCTIONS operations."""
+    names = set()
+    for y in instructions:
+        names.update(re.findall(r'CSR\[([A-Za-z_][A-Za-z0-9_.]*)\]',
+                                y['operation()']))
+    return names
+
+
+def load_referenced_csrs(dirs, instructions, jobs=1):
+    """
+    Like load_csrs(), but only load the CSRs referenced by INSTRUCTIONS.
+    CSRs are looked up as DIR/<name>.yaml, falling back to loading all of
+    DIRS if any of them is defined in a file named differently.
+    """
+    names = referenced_csrs(instructions)
+    found = set()
+    paths = []
+    for dir in dirs:
+        for file in sorted(f'{name}.yaml' for name in names):
+            path = os.path.join(dir, file)
+            if os.path.exists(path):
+                paths.append(path)
+                found.add(file[:-len('.yaml')])
+    if found != names:
+        csrs = load_csrs(dirs, jobs)
+        return {name: y for name, y in csrs.items() if name in names}
+    return {y['name']: y for y in load_yaml_files(paths, jobs)}
 
 
 def get_anyof_extensions_from_yaml(y):
@@ -173,87 +599,104 @@ def sub_to_csr_write_field(match):
     return f'xqci_csrw_field_xreg(this, {csr}, {csr.upper()}_{field}, {value});'
 
 
-def op_to_cpp(op, csrs, for_klee=False):
-    for csr in csrs:
-        csr_name = re.sub(r'\.', '_', csr)
-        op = re.sub(csr, csr_name, op)
-
-    processed_op = ""
-    for line in op.splitlines():
-        if len(line) == 0:
-            continue
-        stripped_line = line.rstrip()
-        if not '#' in stripped_line and not stripped_line[-1] in {'{', ';', '}'}:
-            processed_op += stripped_line
-        else:
-            processed_op += stripped_line + '\n'
-    op = processed_op
-
-    op = re.sub(r'#', r'//', op)
-    op = re.sub(r'\$signed', r'_signed', op)
-    op = re.sub(r'\$encoding', r'0', op)
-
-    op = re.sub(r'raise (.*) if (.*);', r'// \1', op)
-
-    op = re.sub(r'for \(', r'#pragma unroll\nfor (', op)
-
-    # op = re.sub(r'\(1 << ([a-zA-Z0-9]+)\)', r'(1ul << \1.value())', op)
-
-    op = re.sub(r'Bits<{1\'b0, XLEN}\*2> pair = {X\[rs1 \+ 1\], X\[rs1\]};',
-                r'uint64_t pair = ((uint64_t) X[rs1+1].value() << 32) | ((uint64_t) X[rs1].value());', op)
-    op = re.sub(r'Bits<{1\'b0, MXLEN}\*2> pair = {X\[rs1 \+ 1\], X\[rs1\]};',
-                r'uint64_t pair = ((uint64_t) X[rs1+1].value() << 32) | ((uint64_t) X[rs1].value());', op)
-    # op = re.sub(r'{{XLEN{X\[([a-zA-Z0-9]+)\]\[xlen\(\)-1\]}}, X\[\1\]}', r'((int64_t)(int32_t)X[\1].value)', op)
-    # op = re.sub(r"{{XLEN-5{1'b0}}, ([a-zA-Z0-9]+)}", r'((uint32_t) \1)', op)
-
-    op = re.sub(r"([A-Za-z0-9]+)'b([0-9]+)", r'Bits<\1>(0b\2)', op)
-    op = re.sub(r"([A-Za-z0-9]+)'h([0-9A-Fa-f]+)", r'Bits<\1>(0x\2)', op)
-
-    op = re.sub(
-        r'\[([A-Za-z0-9\(\)\+\-\*/ ]+):([A-Za-z0-9\(\)\+\-\*/ ]+)\]', r'.range<\2,\1>()', op)
-    op = re.sub(r'([_a-zA-Z0-9]+)\.range', r'XReg(\1).range', op)
-    op = re.sub(r'XReg(.*)=(.*)\? {(.*)} : {(.*)};',
-                r'XReg\1=\2? XReg(\3) : XReg(\4);', op)
-    op = re.sub(
-        r'implemented\?\(ExtensionName::([a-zA-Z]*)\)', r'xqci_implemented_\1()', op)
-    op = re.sub(
-        r'raise\(ExceptionCode::([a-zA-Z]*)\,.*\);', r'xqci_raise_\1();', op)
-    op = re.sub(
-        r'set_mode\(PrivilegeMode::([a-zA-Z]*)\);', r'xqci_set_mode_\1();', op)
-    op = re.sub(r'\$pc =', r'pc =', op)
-    op = re.sub(r'\$pc', r'xqci_current_pc()', op)
-
-    op = re.sub(
-        r'{([A-Za-z0-9\(\)\+\-\*/ ]+){([A-Za-z0-9\(\)\[\]<>\+\-\*/, ]+)}}', r'repeat<\1>(\2)', op)
-
-    op = re.sub(r'csr_sw_write\(', r'csr_sw_write(this, ', op)
-    op = re.sub(r'csr_sw_read\(', r'csr_sw_read(this, ', op)
-
-    op = re.sub(r'jump_halfword\(xqci_current_pc\(\)[ ]+\+[ ]+([a-z_A-Z\(\)]+)\)',
-                r'xqci_jump_pcrel_bits(maybe_sext_xreg(\1))', op)
-    op = re.sub(r'jump\(([a-z_A-Z0-9\[\]]+)\)', r'xqci_jump(\1, 0)', op)
-
-    op = re.sub(r'CSR\[([a-zA-z0-9]+)\]\.address\(\)', sub_to_csr_address, op)
-    op = re.sub(r'CSR\[([a-zA-z0-9 \+\*\/]+)\]\.sw_read\(\)',
-                sub_to_csr_read, op)
-    op = re.sub(
-        r'CSR\[([a-zA-z0-9 \+\*\/]+)\]\.sw_write\((.*)\)', sub_to_csr_write, op)
-
-    op = re.sub(r'CSR\[([a-zA-z0-9 \+\*\/]+)\]\.([A-Z]*) = (.*);',
-                sub_to_csr_write_field, op)
-    op = re.sub(r'CSR\[([a-zA-z0-9 \+\*\/]+)\]\.([A-Z]*)',
-                sub_to_csr_read_field, op)
-    op = re.sub(r'CSR\[([a-zA-z0-9 \+\*\/]+)\]', sub_to_csr_read, op)
-
-    op = re.sub(r'Bits<xlen\(\)`\*2>', 'Bits<xlen()*2>', op)
-    op = re.sub(r'(.*) = (.*) `\+ (.*);', r'\1 = wide_add(\2, \3);', op)
-    op = re.sub(r'(.*) = (.*) `\- (.*);', r'\1 = wide_sub(\2, \3);', op)
-    op = re.sub(r'\(([A-Za-z0-9_ ]+)`<<([A-Za-z0-9_ ]+)\)',
-                r'wide_shl<\2>(\1)', op)
-
-    op = re.sub(r'\$bits\((.*)\)', r'XReg(\1)', op)
+# IDL -> C++ rewrites applied in order by op_to_cpp_regex(), compiled once.
+op_rewrites = [(re.compile(pattern), repl) for pattern, repl in [
+    (r'#', r'//'),
+    (r'\$signed', r'_signed'),
+    (r'\$encoding', r'0'),
+
+    (r'raise (.*) if (.*);', r'// \1'),
+
+    (r'for \(', r'#pragma unroll\nfor ('),
+
+    # (r'\(1 << ([a-zA-Z0-9]+)\)', r'(1ul << \1.value())'),
+
+    (r'Bits<{1\'b0, XLEN}\*2> pair = {X\[rs1 \+ 1\], X\[rs1\]};',
+     r'uint64_t pair = ((uint64_t) X[rs1+1].value() << 32) | ((uint64_t) X[rs1].value());'),
+    (r'Bits<{1\'b0, MXLEN}\*2> pair = {X\[rs1 \+ 1\], X\[rs1\]};',
+     r'uint64_t pair = ((uint64_t) X[rs1+1].value() << 32) | ((uint64_t) X[rs1].value());'),
+    # (r'{{XLEN{X\[([a-zA-Z0-9]+)\]\[xlen\(\)-1\]}}, X\[\1\]}', r'((int64_t)(int32_t)X[\1].value)'),
+    # (r"{{XLEN-5{1'b0}}, ([a-zA-Z0-9]+)}", r'((uint32_t) \1)'),
+
+    (r"([A-Za-z0-9]+)'b([0-9]+)", r'Bits<\1>(0b\2)'),
+    (r"([A-Za-z0-9]+)'h([0-9A-Fa-f]+)", r'Bits<\1>(0x\2)'),
+
+    (r'\[([A-Za-z0-9\(\)\+\-\*/ ]+):([A-Za-z0-9\(\)\+\-\*/ ]+)\]', r'.range<\2,\1>()'),
+    (r'([_a-zA-Z0-9]+)\.range', r'XReg(\1).range'),
+    (r'XReg(.*)=(.*)\? {(.*)} : {(.*)};', r'XReg\1=\2? XReg(\3) : XReg(\4);'),
+    (r'implemented\?\(ExtensionName::([a-zA-Z]*)\)', r'xqci_implemented_\1()'),
+    (r'raise\(ExceptionCode::([a-zA-Z]*)\,.*\);', r'xqci_raise_\1();'),
+    (r'set_mode\(PrivilegeMode::([a-zA-Z]*)\);', r'xqci_set_mode_\1();'),
+    (r'\$pc =', r'pc ='),
+    (r'\$pc', r'xqci_current_pc()'),
+
+    (r'{([A-Za-z0-9\(\)\+\-\*/ ]+){([A-Za-z0-9\(\)\[\]<>\+\-\*/, ]+)}}', r'repeat<\1>(\2)'),
+
+    (r'csr_sw_write\(', r'csr_sw_write(this, '),
+    (r'csr_sw_read\(', r'csr_sw_read(this, '),
+
+    (r'jump_halfword\(xqci_current_pc\(\)[ ]+\+[ ]+([a-z_A-Z\(\)]+)\)',
+     r'xqci_jump_pcrel_bits(maybe_sext_xreg(\1))'),
+    (r'jump\(([a-z_A-Z0-9\[\]]+)\)', r'xqci_jump(\1, 0)'),
+
+    (r'CSR\[([a-zA-z0-9]+)\]\.address\(\)', sub_to_csr_address),
+    (r'CSR\[([a-zA-z0-9 \+\*\/]+)\]\.sw_read\(\)', sub_to_csr_read),
+    (r'CSR\[([a-zA-z0-9 \+\*\/]+)\]\.sw_write\((.*)\)', sub_to_csr_write),
+
+    (r'CSR\[([a-zA-z0-9 \+\*\/]+)\]\.([A-Z]*) = (.*);', sub_to_csr_write_field),
+    (r'CSR\[([a-zA-z0-9 \+\*\/]+)\]\.([A-Z]*)', sub_to_csr_read_field),
+    (r'CSR\[([a-zA-z0-9 \+\*\/]+)\]', sub_to_csr_read),
+
+    (r'Bits<xlen\(\)`\*2>', 'Bits<xlen()*2>'),
+    (r'(.*) = (.*) `\+ (.*);', r'\1 = wide_add(\2, \3);'),
+    (r'(.*) = (.*) `\- (.*);', r'\1 = wide_sub(\2, \3);'),
+    (r'\(([A-Za-z0-9_ ]+)`<<([A-Za-z0-9_ ]+)\)', r'wide_shl<\2>(\1)'),
+
+    (r'\$bits\((.*)\)', r'XReg(\1)'),
+]]
+
+# Only applied outside of KLEE inputs, after op_rewrites.
+op_gpr_write = (re.compile(r'X\[(.*)\].* = (.*);'), r'xqci_set_gpr_xreg(\1, \2);')
+
+
+@functools.lru_cache(maxsize=None)
+def csr_name_regex(names):
+    """
+    Return a regex matching any of the dotted CSR NAMES, longest first so
+    that names which are prefixes of others do not shadow them, or None.
+    """
+    if not names:
+        return None
+    return re.compile('|'.join(re.escape(n)
+                               for n in sorted(names, key=lambda n: (-len(n), n))))
+
+
+def op_to_cpp_regex(op, csr_names, for_klee=False):
+    """
+    Translate OP to C++ by applying op_rewrites to its text, used for
+    operations the IDL parser does not handle.
+    """
+    csr_regex = csr_name_regex(csr_names)
+    if csr_regex:
+        op = csr_regex.sub(lambda m: m.group(0).replace('.', '_'), op)
+
+    op = idl.join_statement_lines(op)
+
+    for regex, repl in op_rewrites:
+        op = regex.sub(repl, op)
 
     if not for_klee:
-        op = re.sub(r'X\[(.*)\].* = (.*);', r'xqci_set_gpr_xreg(\1, \2);', op)
+        regex, repl = op_gpr_write
+        op = regex.sub(repl, op)
 
     return op
+
+
+def op_to_cpp(op, csrs, for_klee=False):
+    # Dots are not valid in C++ identifiers, names without them are kept.
+    csr_names = frozenset(c for c in csrs if '.' in c)
+    try:
+        ast = idl.parse(op)
+    except idl.IdlError:
+        return op_to_cpp_regex(op, csr_names, for_klee)
+    return idl.to_cpp(ast, csr_names, for_klee)
@@ -21,30 +21,52 @@
 #
 
 import io
+import json
 import os
 import re
+import shlex
 import sys
 import getopt
-
-insnwidth = 32
-bitop_width = 32
-insnmask = 0xffffffff
-variablewidth = False
-fields = {}
-arguments = {}
-formats = {}
-allpatterns = []
-anyextern = False
-testforerror = False
-
-translate_prefix = 'trans'
-translate_scope = 'static '
-input_file = ''
-output_file = None
-output_fd = None
-output_null = False
-insntype = 'uint32_t'
-decode_function = 'decode'
+from concurrent.futures import ProcessPoolExecutor
+
+class DecodeContext:
+    """State of one decoder generation job"""
+    def __init__(self):
+        self.insnwidth = 32
+        self.bitop_width = 32
+        self.insnmask = 0xffffffff
+        self.variablewidth = False
+        self.fields = {}
+        self.arguments = {}
+        self.formats = {}
+        self.allpatterns = []
+        # Argument sets and formats by field names, for inference
+        self.argument_index = {}
+        self.format_index = {}
+        self.anyextern = False
+        self.testforerror = False
+
+        self.translate_prefix = 'trans'
+        self.translate_scope = 'static '
+        self.input_file = ''
+        self.output_file = None
+        self.output_fd = None
+        self.output_null = False
+        self.stats_file = None
+        self.comments = True
+        self.optimize_tree = False
+        self.backend = 'switch'
+        self.profile = {}
+        # Best split found for a set of patterns and outermask, see
+        # ExcMultiPattern.__best_split.
+        self.split_cache = {}
+        self.insntype = 'uint32_t'
+        self.decode_function = 'decode'
+# end DecodeContext
+
+
+# The context of the job currently being generated.
+ctx = DecodeContext()
 
 # An identifier for C.
 re_C_ident = '[a-zA-Z][a-zA-Z0-9_]*'
@@ -55,15 +77,10 @@ re_fld_ident = '%[a-zA-Z0-9_]*'
 re_fmt_ident = '@[a-zA-Z0-9_]*'
 re_pat_ident = '[a-zA-Z0-9_]*'
 
-# Local implementation of a topological sort. We use the same API that
-# the Python graphlib does, so that when QEMU moves forward to a
-# baseline of Python 3.9 or newer this code can all be dropped and
-# replaced with:
-#    from graphlib import TopologicalSorter, CycleError
-#
-# https://docs.python.org/3.9/library/graphlib.html#graphlib.TopologicalSorter
-#
-# We only implement the parts of TopologicalSorter we care about:
+# Topological sort of field definitions, from the Python graphlib module
+# when available (Python 3.9 or newer).  Otherwise a local implementation
+# with the same API is used, we only implement the parts of
+# TopologicalSorter we care about:
 #  ts = TopologicalSorter(graph=None)
 #    create the sorter. graph is a dictionary whose keys are
 #    nodes and whose values are lists of the predecessors of that node.
@@ -77,67 +94,65 @@ re_pat_ident = '[a-zA-Z0-9_]*'
 #    cycle; the first and last element are the same, eg [a, b, c, a]
 #    (Our implementation doesn't give the order correctly.)
 #
-# For our purposes we can assume that the data set is always small
-# (typically 10 nodes or less, actual links in the graph very rare),
-# so we don't need to worry about efficiency of implementation.
-#
-# The core of this implementation is from
-# https://code.activestate.com/recipes/578272-topological-sort/
-# (but updated to Python 3), and is under the MIT license.
-
-class CycleError(ValueError):
-    """Subclass of ValueError raised if cycles exist in the graph"""
-    pass
-
-class TopologicalSorter:
-    """Topologically sort a graph"""
-    def __init__(self, graph=None):
-        self.graph = graph
-
-    def static_order(self):
-        # We do the sort right here, unlike the stdlib version
-        from functools import reduce
-        data = {}
-        r = []
-
-        if not self.graph:
-            return []
-
-        # This code wants the values in the dict to be specifically sets
-        for k, v in self.graph.items():
-            data[k] = set(v)
-
-        # Find all items that don't depend on anything.
-        extra_items_in_deps = (reduce(set.union, data.values())
-                               - set(data.keys()))
-        # Add empty dependencies where needed
-        data.update({item:{} for item in extra_items_in_deps})
-        while True:
-            ordered = set(item for item, dep in data.items() if not dep)
-            if not ordered:
-                break
-            r.extend(ordered)
-            data = {item: (dep - ordered)
-                    for item, dep in data.items()
-                        if item not in ordered}
-        if data:
-            # This doesn't give as nice results as the stdlib, which
-            # gives you the cycle by listing the nodes in order. Here
-            # we only know the nodes in the cycle but not their order.
-            raise CycleError(f'nodes are in a cycle', list(data.keys()))
+# https://docs.python.org/3.9/library/graphlib.html#graphlib.TopologicalSorter
 
-        return r
+try:
+    from graphlib import TopologicalSorter, CycleError
+except ImportError:
+    class CycleError(ValueError):
+        """Subclass of ValueError raised if cycles exist in the graph"""
+        pass
+
+    class TopologicalSorter:
+        """Topologically sort a graph"""
+        def __init__(self, graph=None):
+            self.graph = graph
+
+        def static_order(self):
+            # Kahn's algorithm, nodes are emitted in the order they were
+            # first seen once all of their predecessors were.
+            if not self.graph:
+                return []
+
+            preds = {}
+            succs = {}
+            for k, v in self.graph.items():
+                preds.setdefault(k, set())
+                for d in v:
+                    preds.setdefault(d, set())
+                    if d not in preds[k]:
+                        preds[k].add(d)
+                        succs.setdefault(d, []).append(k)
+
+            ready = [n for n, d in preds.items() if not d]
+            r = []
+            while ready:
+                n = ready.pop(0)
+                r.append(n)
+                for s in succs.get(n, []):
+                    preds[s].discard(n)
+                    if not preds[s]:
+                        ready.append(s)
+
+            if len(r) != len(preds):
+                # This doesn't give as nice results as the stdlib, which
+                # gives you the cycle by listing the nodes in order. Here
+                # we only know the nodes in the cycle but not their order.
+                raise CycleError(f'nodes are in a cycle',
+                                 [n for n, d in preds.items() if d])
+
+            return r
 # end TopologicalSorter
 
 def error_with_file(file, lineno, *args):
     """Print an error message from file:line and args and exit."""
-    global output_file
-    global output_fd
+    # Output is only written once generation succeeded, so there is
+    # never a partially written output file to clean up here.
 
     # For the test suite expected-errors case, don't print the
     # string "error: ", so they don't turn up as false positives
     # if you grep the meson logs for strings like that.
-    end = 'error: ' if not testforerror else 'detected: '
+    end = 'error: ' if not ctx.testforerror else 'detected: '
     prefix = ''
     if file:
         prefix += f'{file}:'
@@ -148,22 +163,48 @@ def error_with_file(file, lineno, *args):
     print(prefix, end=end, file=sys.stderr)
     print(*args, file=sys.stderr)
 
-    if output_file and output_fd:
-        output_fd.close()
-        os.remove(output_file)
-    exit(0 if testforerror else 1)
+    exit(0 if ctx.testforerror else 1)
 # end error_with_file
 
 
 def error(lineno, *args):
-    error_with_file(input_file, lineno, *args)
+    error_with_file(ctx.input_file, lineno, *args)
 # end error
 
 
 def output(*args):
-    global output_fd
-    for a in args:
-        output_fd.write(a)
+    ctx.output_fd.write(''.join(args))
+
+
+def write_output(text):
+    """Write the generated TEXT in one go.
+
+    Output files are replaced atomically through a temporary file, and
+    left untouched if their contents did not change."""
+    if ctx.output_null:
+        return
+    if not ctx.output_file:
+        sys.stdout.buffer.write(text.encode(sys.stdout.encoding,
+                                            errors='ignore'))
+        sys.stdout.buffer.flush()
+        return
+
+    data = text.encode('utf-8')
+    try:
+        with open(ctx.output_file, 'rb') as f:
+            if f.read() == data:
+                return
+    except OSError:
+        pass
+    tmp = f'{ctx.output_file}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, ctx.output_file)
+    except OSError as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        error(0, f'cannot write {ctx.output_file}: {e.strerror}')
 
 
 def output_autogen():
@@ -185,8 +226,7 @@ def str_fields(fields):
 
 def whex(val):
     """Return a hex string for val padded for insnwidth"""
-    global insnwidth
-    return f'0x{val:0{insnwidth // 4}x}'
+    return f'0x{val:0{ctx.insnwidth // 4}x}'
 
 
 def whexC(val):
@@ -200,25 +240,21 @@ def whexC(val):
     return whex(val) + suffix
 
 
+# Pretty-printed bits of a nibble, indexed by (mask << 4) | bits.
+match_nibbles = [''.join('01'[(b >> k) & 1] if (m >> k) & 1 else '.'
+                         for k in (3, 2, 1, 0))
+                 for m in range(16) for b in range(16)]
+
+
 def str_match_bits(bits, mask):
     """Return a string pretty-printing BITS/MASK"""
-    global insnwidth
-
-    i = 1 << (insnwidth - 1)
-    space = 0x01010100
-    r = ''
-    while i != 0:
-        if i & mask:
-            if i & bits:
-                r += '1'
-            else:
-                r += '0'
-        else:
-            r += '.'
-        if i & space:
-            r += ' '
-        i >>= 1
-    return r
+    w = ctx.insnwidth
+    bits &= mask
+    r = ''.join([match_nibbles[((mask >> k) & 0xf) << 4 | ((bits >> k) & 0xf)]
+                 for k in range(w - 4, -1, -4)])
+    # Separate the low three bytes.
+    cut = [w - k for k in (24, 16, 8) if k < w]
+    return ' '.join([r[a:b] for a, b in zip([0] + cut, cut + [w])])
 
 
 def is_pow2(x):
@@ -229,10 +265,7 @@ def is_pow2(x):
 def ctz(x):
     """Return the number of times 2 factors into X."""
     assert x != 0
-    r = 0
-    while ((x >> r) & 1) == 0:
-        r += 1
-    return r
+    return (x & -x).bit_length() - 1
 
 
 def is_contiguous(bits):
@@ -245,6 +278,47 @@ def is_contiguous(bits):
         return -1
 
 
+def contiguous_runs(bits):
+    """Return the maximal contiguous runs of set bits in BITS as masks."""
+    runs = []
+    while bits != 0:
+        low = bits & -bits
+        run = bits & ~(bits + low)
+        runs.append(run)
+        bits &= ~run
+    return runs
+
+
+def switch_cost(mask, ncases):
+    """Estimate the cost of a switch on MASK with NCASES cases.
+
+    Contiguous masks are extracted with a shift and compile to a jump
+    table, other masks are likely to become a chain of comparisons."""
+    if is_contiguous(mask) >= 0:
+        return 1
+    return max(1, ncases.bit_length())
+
+
+def pattern_weight(p):
+    """Return the weight of P in the expected decode cost, from the profile
+    if one is given."""
+    if isinstance(p, MultiPattern):
+        return sum(pattern_weight(s) for s in p.pats)
+    if ctx.profile:
+        return ctx.profile.get(p.name, 0) + 1
+    return 1
+
+
+def profile_count(p):
+    """Return the number of times P was decoded in the profile, without
+    the pseudo-count of pattern_weight."""
+    if isinstance(p, MultiPattern):
+        return sum(profile_count(s) for s in p.pats)
+    if ctx.profile:
+        return ctx.profile.get(p.name, 0)
+    return 0
+
+
 def eq_fields_for_args(flds_a, arg):
     if len(flds_a) != len(arg.fields):
         return False
@@ -286,9 +360,8 @@ class Field:
         return str(self.pos) + ':' + s + str(self.len)
 
     def str_extract(self, lvalue_formatter):
-        global bitop_width
         s = 's' if self.sign else ''
-        return f'{s}extract{bitop_width}(insn, {self.pos}, {self.len})'
+        return f'{s}extract{ctx.bitop_width}(insn, {self.pos}, {self.len})'
 
     def referenced_fields(self):
         return []
@@ -312,7 +385,6 @@ class MultiField:
         return str(self.subs)
 
     def str_extract(self, lvalue_formatter):
-        global bitop_width
         ret = '0'
         pos = 0
         for f in reversed(self.subs):
@@ -320,7 +392,7 @@ class MultiField:
             if pos == 0:
                 ret = ext
             else:
-                ret = f'deposit{bitop_width}({ret}, {pos}, {bitop_width - pos}, {ext})'
+                ret = f'deposit{ctx.bitop_width}({ret}, {pos}, {ctx.bitop_width - pos}, {ext})'
             pos += f.len
         return ret
 
@@ -425,10 +497,9 @@ class NamedField:
         return self.name
 
     def str_extract(self, lvalue_formatter):
-        global bitop_width
         s = 's' if self.sign else ''
         lvalue = lvalue_formatter(self.name)
-        return f'{s}extract{bitop_width}({lvalue}, 0, {self.len})'
+        return f'{s}extract{ctx.bitop_width}({lvalue}, 0, {self.len})'
 
     def referenced_fields(self):
         return [self.name]
@@ -466,7 +537,7 @@ class General:
     """Common code between instruction formats and instruction patterns"""
     def __init__(self, name, lineno, base, fixb, fixm, udfm, fldm, flds, w):
         self.name = name
-        self.file = input_file
+        self.file = ctx.input_file
         self.lineno = lineno
         self.base = base
         self.fixedbits = fixb
@@ -476,6 +547,8 @@ class General:
         self.fields = flds
         self.width = w
         self.dangling = None
+        self.field_order = None
+        self.format_refs = None
 
     def __str__(self):
         return self.name + ' ' + str_match_bits(self.fixedbits, self.fixedmask)
@@ -501,33 +574,34 @@ class General:
             self.dangling = dangling
         return self.dangling
 
-    def output_fields(self, indent, lvalue_formatter):
+    def sorted_fields(self):
         # We use a topological sort to ensure that any use of NamedField
         # comes after the initialization of the field it is referencing.
-        graph = {}
-        for n, f in self.fields.items():
-            refs = f.referenced_fields()
-            graph[n] = refs
-
-        try:
-            ts = TopologicalSorter(graph)
-            for n in ts.static_order():
-                # We only want to emit assignments for the keys
-                # in our fields list, not for anything that ends up
-                # in the tsort graph only because it was referenced as
-                # a NamedField.
-                try:
-                    f = self.fields[n]
-                    output(indent, lvalue_formatter(n), ' = ',
-                           f.str_extract(lvalue_formatter), ';\n')
-                except KeyError:
-                    pass
-        except CycleError as e:
-            # The second element of args is a list of nodes which form
-            # a cycle (there might be others too, but only one is reported).
-            # Pretty-print it to tell the user.
-            cycle = ' => '.join(e.args[1])
-            error(self.lineno, 'field definitions form a cycle: ' + cycle)
+        if self.field_order is None:
+            # Compute this once and cache the answer
+            graph = {}
+            for n, f in self.fields.items():
+                graph[n] = f.referenced_fields()
+
+            try:
+                order = list(TopologicalSorter(graph).static_order())
+            except CycleError as e:
+                # The second element of args is a list of nodes which form
+                # a cycle (there might be others too, but only one is
+                # reported).  Pretty-print it to tell the user.
+                cycle = ' => '.join(e.args[1])
+                error(self.lineno, 'field definitions form a cycle: ' + cycle)
+
+            # We only want to emit assignments for the keys in our fields
+            # list, not for anything that ends up in the tsort graph only
+            # because it was referenced as a NamedField.
+            self.field_order = [n for n in order if n in self.fields]
+        return self.field_order
+
+    def output_fields(self, indent, lvalue_formatter):
+        for n in self.sorted_fields():
+            output(indent, lvalue_formatter(n), ' = ',
+                   self.fields[n].str_extract(lvalue_formatter), ';\n')
 # end General
 
 
@@ -535,12 +609,11 @@ class Format(General):
     """Class representing an instruction format"""
 
     def extract_name(self):
-        global decode_function
-        return decode_function + '_extract_' + self.name
+        return ctx.decode_function + '_extract_' + self.name
 
     def output_extract(self):
         output('static void ', self.extract_name(), '(rv_decode *dec, ',
-               self.base.struct_name(), ' *a, ', insntype, ' insn)\n{\n')
+               self.base.struct_name(), ' *a, ', ctx.insntype, ' insn)\n{\n')
         self.output_fields(str_indent(4), lambda n: 'a->' + n)
         output('}\n\n')
 # end Format
@@ -550,18 +623,21 @@ class Pattern(General):
     """Class representing an instruction pattern"""
 
     def output_decl(self):
-        global translate_scope
-        global translate_prefix
         output('typedef ', self.base.base.struct_name(),
                ' arg_', self.name, ';\n')
-        output(translate_scope, 'bool ', translate_prefix, '_', self.name,
+        output(ctx.translate_scope, 'bool ', ctx.translate_prefix, '_', self.name,
                '(rv_decode *dec, arg_', self.name, ' *a);\n')
 
     def output_code(self, i, extracted, outerbits, outermask):
-        global translate_prefix
         ind = str_indent(i)
         arg = self.base.base.name
-        output(ind, '/* ', self.file, ':', str(self.lineno), ' */\n')
+        if ctx.comments:
+            output(ind, '/* ', self.file, ':', str(self.lineno), ' */\n')
+        self.output_args(ind, extracted)
+        output(ind, 'if (', ctx.translate_prefix, '_', self.name,
+               '(dec, &u.f_', arg, ')) return true;\n')
+
+    def check_references(self):
         # We might have named references in the format that refer to fields
         # in the pattern, or named references in the pattern that refer
         # to fields in the format. This affects whether we extract the fields
@@ -569,18 +645,27 @@ class Pattern(General):
         # For simplicity we don't allow cross references in both directions.
         # This is also where we catch the syntax error of referring to
         # a nonexistent field.
-        fmt_refs = self.base.dangling_references()
-        for r in fmt_refs:
-            if r not in self.fields:
-                error(self.lineno, f'format refers to undefined field {r}')
-        pat_refs = self.dangling_references()
-        for r in pat_refs:
-            if r not in self.base.fields:
-                error(self.lineno, f'pattern refers to undefined field {r}')
-        if pat_refs and fmt_refs:
-            error(self.lineno, ('pattern that uses fields defined in format '
-                                'cannot use format that uses fields defined '
-                                'in pattern'))
+        if self.format_refs is None:
+            # Compute this once and cache the answer
+            fmt_refs = self.base.dangling_references()
+            for r in fmt_refs:
+                if r not in self.fields:
+                    error(self.lineno, f'format refers to undefined field {r}')
+            pat_refs = self.dangling_references()
+            for r in pat_refs:
+                if r not in self.base.fields:
+                    error(self.lineno, f'pattern refers to undefined field {r}')
+            if pat_refs and fmt_refs:
+                error(self.lineno, ('pattern that uses fields defined in format '
+                                    'cannot use format that uses fields defined '
+                                    'in pattern'))
+            self.format_refs = fmt_refs
+        return self.format_refs
+
+    def output_args(self, ind, extracted):
+        """Extract the argument set passed to the translate function"""
+        arg = self.base.base.name
+        fmt_refs = self.check_references()
         if fmt_refs:
             # pattern fields first
             self.output_fields(ind, lambda n: 'u.f_' + arg + '.' + n)
@@ -592,9 +677,6 @@ class Pattern(General):
             # pattern fields last
             self.output_fields(ind, lambda n: 'u.f_' + arg + '.' + n)
 
-        output(ind, 'if (', translate_prefix, '_', self.name,
-               '(dec, &u.f_', arg, ')) return true;\n')
-
     # Normal patterns do not have children.
     def build_tree(self):
         return
@@ -612,7 +694,7 @@ class MultiPattern(General):
     """Class representing a set of instruction patterns"""
 
     def __init__(self, lineno):
-        self.file = input_file
+        self.file = ctx.input_file
         self.lineno = lineno
         self.pats = []
         self.base = None
@@ -632,10 +714,9 @@ class MultiPattern(General):
             p.output_decl()
 
     def prop_masks(self):
-        global insnmask
 
-        fixedmask = insnmask
-        undefmask = insnmask
+        fixedmask = ctx.insnmask
+        undefmask = ctx.insnmask
 
         # Collect fixedmask/undefmask for all of the children.
         for p in self.pats:
@@ -688,14 +769,20 @@ class IncMultiPattern(MultiPattern):
     """Class representing an overlapping set of instruction patterns"""
 
     def output_code(self, i, extracted, outerbits, outermask):
-        global translate_prefix
         ind = str_indent(i)
+        total = sum(profile_count(p) for p in self.pats)
         for p in self.pats:
             if outermask != p.fixedmask:
                 innermask = p.fixedmask & ~outermask
                 innerbits = p.fixedbits & ~outermask
-                output(ind, f'if ((insn & {whexC(innermask)}) == {whexC(innerbits)}) {{\n')
-                output(ind, f'    /* {str_match_bits(p.fixedbits, p.fixedmask)} */\n')
+                cond = f'(insn & {whexC(innermask)}) == {whexC(innerbits)}'
+                # Hint members taking most of the profiled group.
+                if total > 0 and 2 * profile_count(p) > total:
+                    cond = f'likely({cond})'
+                output(ind, f'if ({cond}) {{\n')
+                if ctx.comments:
+                    output(ind, '    /* ',
+                           str_match_bits(p.fixedbits, p.fixedmask), ' */\n')
                 p.output_code(i + 4, extracted, p.fixedbits, p.fixedmask)
                 output(ind, '}\n')
             else:
@@ -705,6 +792,30 @@ class IncMultiPattern(MultiPattern):
         if not self.pats:
             error_with_file(self.file, self.lineno, 'empty pattern group')
         super().build_tree()
+        if ctx.profile:
+            self.pats = self.__profile_order(self.pats)
+
+    @staticmethod
+    def __profile_order(pats):
+        """Order PATS by decreasing profile count.
+
+        The first matching member of a group wins, so a member may only
+        move ahead of members it cannot overlap with. Members are only
+        moved for a higher count, equal counts keep the source order."""
+        def overlaps(a, b):
+            return ((a.fixedbits ^ b.fixedbits) & a.fixedmask & b.fixedmask) == 0
+
+        remaining = list(pats)
+        ordered = []
+        while remaining:
+            best = None
+            for j, p in enumerate(remaining):
+                if any(overlaps(q, p) for q in remaining[:j]):
+                    continue
+                if best is None or profile_count(p) > profile_count(remaining[best]):
+                    best = j
+            ordered.append(remaining.pop(best))
+        return ordered
 
 #end IncMultiPattern
 
@@ -768,8 +879,9 @@ class Tree:
             innermask = outermask | self.thismask
             innerbits = outerbits | b
             output(ind, 'case ', str_case(b), ':\n')
-            output(ind, '    /* ',
-                   str_match_bits(innerbits, innermask), ' */\n')
+            if ctx.comments:
+                output(ind, '    /* ',
+                       str_match_bits(innerbits, innermask), ' */\n')
             s.output_code(i + 4, extracted, innerbits, innermask)
             output(ind, '    break;\n')
         output(ind, '}\n')
@@ -783,10 +895,49 @@ class ExcMultiPattern(MultiPattern):
         # Defer everything to our decomposed Tree node
         self.tree.output_code(i, extracted, outerbits, outermask)
 
+    @staticmethod
+    def __best_split(pats, outermask, innermask):
+        """Return (cost, mask) of the subset of INNERMASK to switch on first.
+
+        Any subset of the bits fixed in all PATS is a valid split, try the
+        whole of INNERMASK and each of its contiguous runs and pick the one
+        minimizing the expected number of switch levels, weighted by
+        pattern_weight and the cost of each switch."""
+        key = (tuple(id(p) for p in pats), outermask)
+        if key in ctx.split_cache:
+            return ctx.split_cache[key]
+
+        candidates = [innermask]
+        if is_contiguous(innermask) < 0:
+            candidates += contiguous_runs(innermask)
+
+        weight = sum(pattern_weight(p) for p in pats)
+        best = None
+        for mask in candidates:
+            fullmask = outermask | mask
+            bins = {}
+            for p in pats:
+                bins.setdefault(p.fixedbits & mask, []).append(p)
+            cost = weight * switch_cost(mask, len(bins))
+            for l in bins.values():
+                if len(l) > 1 or l[0].fixedmask & ~fullmask != 0:
+                    binmask = ~fullmask & ctx.insnmask
+                    for p in l:
+                        binmask &= p.fixedmask
+                    # Overlapping patterns are reported by __build_tree.
+                    if binmask != 0:
+                        cost += ExcMultiPattern.__best_split(l, fullmask,
+                                                             binmask)[0]
+            if best is None or cost < best[0]:
+                best = (cost, mask)
+
+        ctx.split_cache[key] = best
+        return best
+
     @staticmethod
     def __build_tree(pats, outerbits, outermask):
         # Find the intersection of all remaining fixedmask.
-        innermask = ~outermask & insnmask
+        innermask = ~outermask & ctx.insnmask
         for i in pats:
             innermask &= i.fixedmask
 
@@ -802,6 +953,10 @@ class ExcMultiPattern(MultiPattern):
                 text += '\n' + p.file + ':' + str(p.lineno) + ': ' + str(p)
             error_with_file(pats[0].file, pats[0].lineno, text)
 
+        if ctx.optimize_tree:
+            innermask = ExcMultiPattern.__best_split(pats, outermask,
+                                                     innermask)[1]
+
         fullmask = outermask | innermask
 
         # Sort each element of pats into the bin selected by the mask.
@@ -860,8 +1015,6 @@ class ExcMultiPattern(MultiPattern):
 
 def parse_field(lineno, name, toks):
     """Parse one instruction field from TOKS at LINENO"""
-    global fields
-    global insnwidth
     global re_C_ident
 
     # A "simple" field will have only one entry;
@@ -908,13 +1061,13 @@ def parse_field(lineno, name, toks):
             error(lineno, f'invalid field token "{t}"')
         po = int(subtoks[0])
         le = int(subtoks[1])
-        if po + le > insnwidth:
+        if po + le > ctx.insnwidth:
             error(lineno, f'field {t} too large')
         f = Field(sign, po, le)
         subs.append(f)
         width += le
 
-    if width > insnwidth:
+    if width > ctx.insnwidth:
         error(lineno, 'field too large')
     if len(subs) == 0:
         if func:
@@ -934,17 +1087,15 @@ def parse_field(lineno, name, toks):
         if func:
             f = FunctionField(func, f)
 
-    if name in fields:
+    if name in ctx.fields:
         error(lineno, 'duplicate field', name)
-    fields[name] = f
+    ctx.fields[name] = f
 # end parse_field
 
 
 def parse_arguments(lineno, name, toks):
     """Parse one argument set from TOKS at LINENO"""
-    global arguments
     global re_C_ident
-    global anyextern
 
     flds = []
     types = []
@@ -952,7 +1103,7 @@ def parse_arguments(lineno, name, toks):
     for n in toks:
         if re.fullmatch('!extern', n):
             extern = True
-            anyextern = True
+            ctx.anyextern = True
             continue
         if re.fullmatch(re_C_ident + ':' + re_C_ident, n):
             (n, t) = n.split(':')
@@ -965,16 +1116,26 @@ def parse_arguments(lineno, name, toks):
         flds.append(n)
         types.append(t)
 
-    if name in arguments:
+    if name in ctx.arguments:
         error(lineno, 'duplicate argument set', name)
-    arguments[name] = Arguments(name, flds, types, extern)
+    add_arguments(Arguments(name, flds, types, extern))
 # end parse_arguments
 
 
+def add_arguments(arg):
+    ctx.arguments[arg.name] = arg
+    ctx.argument_index.setdefault(frozenset(arg.fields), []).append(arg)
+
+
+def add_format(fmt):
+    ctx.formats[fmt.name] = fmt
+    key = (fmt.fieldmask, fmt.width, frozenset(fmt.fields))
+    ctx.format_index.setdefault(key, []).append(fmt)
+
+
 def lookup_field(lineno, name):
-    global fields
-    if name in fields:
-        return fields[name]
+    if name in ctx.fields:
+        return ctx.fields[name]
     error(lineno, 'undefined field', name)
 
 
@@ -990,23 +1151,18 @@ def add_field_byname(lineno, flds, new_name, old_name):
 
 
 def infer_argument_set(flds):
-    global arguments
-    global decode_function
 
-    for arg in arguments.values():
+    for arg in ctx.argument_index.get(frozenset(flds), []):
         if eq_fields_for_args(flds, arg):
             return arg
 
-    name = decode_function + str(len(arguments))
+    name = ctx.decode_function + str(len(ctx.arguments))
     arg = Arguments(name, flds.keys(), ['int'] * len(flds), False)
-    arguments[name] = arg
+    add_arguments(arg)
     return arg
 
 
 def infer_format(arg, fieldmask, flds, width):
-    global arguments
-    global formats
-    global decode_function
 
     const_flds = {}
     var_flds = {}
@@ -1017,23 +1173,19 @@ def infer_format(arg, fieldmask, flds, width):
             var_flds[n] = c
 
     # Look for an existing format with the same argument set and fields
-    for fmt in formats.values():
+    for fmt in ctx.format_index.get((fieldmask, width, frozenset(flds)), []):
         if arg and fmt.base != arg:
             continue
-        if fieldmask != fmt.fieldmask:
-            continue
-        if width != fmt.width:
-            continue
         if not eq_fields_for_fmts(flds, fmt.fields):
             continue
         return (fmt, const_flds)
 
-    name = decode_function + '_Fmt_' + str(len(formats))
+    name = ctx.decode_function + '_Fmt_' + str(len(ctx.formats))
     if not arg:
         arg = infer_argument_set(flds)
 
     fmt = Format(name, 0, arg, 0, 0, 0, fieldmask, var_flds, width)
-    formats[name] = fmt
+    add_format(fmt)
 
     return (fmt, const_flds)
 # end infer_format
@@ -1041,17 +1193,10 @@ def infer_format(arg, fieldmask, flds, width):
 
 def parse_generic(lineno, parent_pat, name, toks):
     """Parse one instruction format from TOKS at LINENO"""
-    global fields
-    global arguments
-    global formats
-    global allpatterns
     global re_arg_ident
     global re_fld_ident
     global re_fmt_ident
     global re_C_ident
-    global insnwidth
-    global insnmask
-    global variablewidth
 
     is_format = parent_pat is None
 
@@ -1068,8 +1213,8 @@ def parse_generic(lineno, parent_pat, name, toks):
             tt = t[1:]
             if arg:
                 error(lineno, 'multiple argument sets')
-            if tt in arguments:
-                arg = arguments[tt]
+            if tt in ctx.arguments:
+                arg = ctx.arguments[tt]
             else:
                 error(lineno, 'undefined argument set', t)
             continue
@@ -1079,8 +1224,8 @@ def parse_generic(lineno, parent_pat, name, toks):
             tt = t[1:]
             if fmt:
                 error(lineno, 'multiple formats')
-            if tt in formats:
-                fmt = formats[tt]
+            if tt in ctx.formats:
+                fmt = ctx.formats[tt]
             else:
                 error(lineno, 'undefined format', t)
             continue
@@ -1130,9 +1275,9 @@ def parse_generic(lineno, parent_pat, name, toks):
                 sign = True
                 flen = flen[1:]
             shift = int(flen, 10)
-            if shift + width > insnwidth:
+            if shift + width > ctx.insnwidth:
                 error(lineno, f'field {fname} exceeds insnwidth')
-            f = Field(sign, insnwidth - width - shift, shift)
+            f = Field(sign, ctx.insnwidth - width - shift, shift)
             flds = add_field(lineno, flds, fname, f)
             fixedbits <<= shift
             fixedmask <<= shift
@@ -1141,15 +1286,15 @@ def parse_generic(lineno, parent_pat, name, toks):
             error(lineno, f'invalid token "{t}"')
         width += shift
 
-    if variablewidth and width < insnwidth and width % 8 == 0:
-        shift = insnwidth - width
+    if ctx.variablewidth and width < ctx.insnwidth and width % 8 == 0:
+        shift = ctx.insnwidth - width
         fixedbits <<= shift
         fixedmask <<= shift
         undefmask <<= shift
         undefmask |= (1 << shift) - 1
 
     # We should have filled in all of the bits of the instruction.
-    elif not (is_format and width == 0) and width != insnwidth:
+    elif not (is_format and width == 0) and width != ctx.insnwidth:
         error(lineno, f'definition has {width} bits')
 
     # Do not check for fields overlapping fields; one valid usage
@@ -1171,11 +1316,11 @@ def parse_generic(lineno, parent_pat, name, toks):
                     error(lineno, f'field {f} not in argument set {arg.name}')
         else:
             arg = infer_argument_set(flds)
-        if name in formats:
+        if name in ctx.formats:
             error(lineno, 'duplicate format name', name)
         fmt = Format(name, lineno, arg, fixedbits, fixedmask,
                      undefmask, fieldmask, flds, width)
-        formats[name] = fmt
+        add_format(fmt)
     else:
         # Patterns can reference a format ...
         if fmt:
@@ -1204,7 +1349,7 @@ def parse_generic(lineno, parent_pat, name, toks):
         pat = Pattern(name, lineno, fmt, fixedbits, fixedmask,
                       undefmask, fieldmask, flds, width)
         parent_pat.pats.append(pat)
-        allpatterns.append(pat)
+        ctx.allpatterns.append(pat)
 
     # Validate the masks that we have assembled.
     if fieldmask & fixedmask:
@@ -1218,9 +1363,9 @@ def parse_generic(lineno, parent_pat, name, toks):
               f'({whex(fixedmask)} & {whex(undefmask)})')
     if not is_format:
         allbits = fieldmask | fixedmask | undefmask
-        if allbits != insnmask:
+        if allbits != ctx.insnmask:
             error(lineno, 'bits left unspecified ',
-                  f'({whex(allbits ^ insnmask)})')
+                  f'({whex(allbits ^ ctx.insnmask)})')
 # end parse_general
 
 
@@ -1365,7 +1510,7 @@ class SizeTree:
 
         # If we need to load more bytes to test, do so now.
         if extracted < self.width:
-            output(ind, f'insn = {decode_function}_load_bytes',
+            output(ind, f'insn = {ctx.decode_function}_load_bytes',
                    f'(dec, insn, {extracted // 8}, {self.width // 8});\n')
             extracted = self.width
 
@@ -1391,8 +1536,9 @@ class SizeTree:
             innermask = outermask | self.mask
             innerbits = outerbits | b
             output(ind, 'case ', str_case(b), ':\n')
-            output(ind, '    /* ',
-                   str_match_bits(innerbits, innermask), ' */\n')
+            if ctx.comments:
+                output(ind, '    /* ',
+                       str_match_bits(innerbits, innermask), ' */\n')
             s.output_code(i + 4, extracted, innerbits, innermask)
         output(ind, '}\n')
         output(ind, 'return insn;\n')
@@ -1412,12 +1558,11 @@ class SizeLeaf:
         return self.str1(0)
 
     def output_code(self, i, extracted, outerbits, outermask):
-        global decode_function
         ind = str_indent(i)
 
         # If we need to load more bytes, do so now.
         if extracted < self.width:
-            output(ind, f'insn = {decode_function}_load_bytes',
+            output(ind, f'insn = {ctx.decode_function}_load_bytes',
                    f'(dec, insn, {extracted // 8}, {self.width // 8});\n')
             extracted = self.width
         output(ind, 'return insn;\n')
@@ -1425,10 +1570,9 @@ class SizeLeaf:
 
 
 def build_size_tree(pats, width, outerbits, outermask):
-    global insnwidth
 
     # Collect the mask of bits that are fixed in this width
-    innermask = 0xff << (insnwidth - width)
+    innermask = 0xff << (ctx.insnwidth - width)
     innermask &= ~outermask
     minwidth = None
     onewidth = True
@@ -1493,62 +1637,381 @@ def prop_size(tree):
 # end prop_size
 
 
-def main():
-    global arguments
-    global formats
-    global allpatterns
-    global translate_scope
-    global translate_prefix
-    global output_fd
-    global output_file
-    global output_null
-    global input_file
-    global insnwidth
-    global insntype
-    global insnmask
-    global decode_function
-    global bitop_width
-    global variablewidth
-    global anyextern
-    global testforerror
+def decode_stats(node, depth, tests, outermask, stats):
+    """Collect statistics of the decoder below NODE into STATS.
+
+    NODE is reached after DEPTH nested switch/if statements performing
+    TESTS mask tests in the worst case.  Returns the worst-case number
+    of mask tests performed inside NODE itself, which are spent before
+    falling through to the next member of an enclosing group."""
+    if isinstance(node, ExcMultiPattern):
+        return decode_stats(node.tree, depth, tests, outermask, stats)
+
+    if isinstance(node, Tree):
+        stats['fanouts'].append(len(node.subs))
+        innermask = outermask | node.thismask
+        worst = 0
+        for b, s in node.subs:
+            worst = max(worst, decode_stats(s, depth + 1, tests + 1,
+                                            innermask, stats))
+        return worst + 1
+
+    if isinstance(node, IncMultiPattern):
+        # Each member may be tested after all members before it
+        # fell through.
+        spent = 0
+        for p in node.pats:
+            check = 0
+            if outermask != p.fixedmask:
+                stats['group_checks'] += 1
+                check = 1
+            spent += check
+            spent += decode_stats(p, depth + check, tests + spent,
+                                  p.fixedmask, stats)
+        return spent
+
+    stats['patterns'].append({
+        'name': node.name,
+        'file': node.file,
+        'line': node.lineno,
+        'depth': depth,
+        'tests': tests,
+    })
+    return 0
+# end decode_stats
+
+
+def size_stats(tree, depth, stats):
+    """Collect statistics of the size decode tree TREE into STATS"""
+    if isinstance(tree, SizeTree):
+        stats['fanouts'].append(len(tree.subs))
+        for b, s in tree.subs:
+            size_stats(s, depth + 1, stats)
+    else:
+        stats['depths'].append(depth)
+# end size_stats
+
+
+def summarize(values):
+    """Return the maximum and average of VALUES for the stats report"""
+    if not values:
+        return 0, 0
+    return max(values), round(sum(values) / len(values), 2)
+# end summarize
+
+
+def output_stats(toppat, stree, decode_scope):
+    """Write a JSON report on the shape of the decoder to stats_file"""
+    stats = {'fanouts': [], 'group_checks': 0, 'patterns': []}
+    decode_stats(toppat, 0, 0, 0, stats)
+
+    pats = stats['patterns']
+    max_depth, avg_depth = summarize([p['depth'] for p in pats])
+    max_tests, avg_tests = summarize([p['tests'] for p in pats])
+    max_fanout, avg_fanout = summarize(stats['fanouts'])
+    report = {
+        'input': ctx.input_file,
+        'insnwidth': ctx.insnwidth,
+        'num_patterns': len(pats),
+        'max_depth': max_depth,
+        'avg_depth': avg_depth,
+        'switches': len(stats['fanouts']),
+        'max_fanout': max_fanout,
+        'avg_fanout': avg_fanout,
+        'group_checks': stats['group_checks'],
+        'max_tests': max_tests,
+        'avg_tests': avg_tests,
+        'patterns': pats,
+    }
+
+    # Source metrics of each backend as a proxy for its code size, not a
+    # measure of object size. Comments are left out, and the constant
+    # decode table of the table backend is reported separately as data,
+    # with its size in memory.
+    report['backend'] = ctx.backend
+    report['backend_source_sizes'] = {}
+    for name, fn in decoder_backends.items():
+        code = strip_comments(capture(fn, toppat, decode_scope))
+        sizes = {}
+        table = re.search(r'^static const .*\[\] = \{\n(.*?)^\};\n',
+                          code, re.M | re.S)
+        if table:
+            code = code[:table.start()] + code[table.end():]
+            # Rows of a mask and a value of the instruction type followed
+            # by two uint16_t, padded to the alignment of the former.
+            word = ctx.insnwidth // 8
+            align = max(word, 2)
+            row = -(-(2 * word + 4) // align) * align
+            rows = table.group(1).count('\n')
+            sizes['table_rows'] = rows
+            sizes['table_data_bytes'] = rows * row
+        sizes['source_bytes'] = len(code)
+        sizes['source_lines'] = code.count('\n')
+        sizes['source_statements'] = code.count(';')
+        report['backend_source_sizes'][name] = sizes
+
+    if stree:
+        sstats = {'fanouts': [], 'depths': []}
+        size_stats(stree, 0, sstats)
+        max_depth, avg_depth = summarize(sstats['depths'])
+        max_fanout, avg_fanout = summarize(sstats['fanouts'])
+        report['size_decoder'] = {
+            'max_depth': max_depth,
+            'avg_depth': avg_depth,
+            'switches': len(sstats['fanouts']),
+            'max_fanout': max_fanout,
+            'avg_fanout': avg_fanout,
+        }
+
+    with open(ctx.stats_file, 'wt', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+# end output_stats
+
+
+def strip_comments(code):
+    """Return CODE without its /* */ comments and comment-only lines"""
+    code = re.sub(r'^[ \t]*/\*.*?\*/[ \t]*\n', '', code, flags=re.M | re.S)
+    return re.sub(r'[ \t]*/\*.*?\*/', '', code, flags=re.S)
+# end strip_comments
+
+
+def capture(fn, *args):
+    """Return everything FN(*ARGS) outputs as a string"""
+    saved = ctx.output_fd
+    ctx.output_fd = io.StringIO()
+    try:
+        fn(*args)
+        return ctx.output_fd.getvalue()
+    finally:
+        ctx.output_fd = saved
+# end capture
+
+
+def decode_leaves(node, leaves):
+    """Append the patterns below NODE to LEAVES in the order they are tried"""
+    if isinstance(node, ExcMultiPattern):
+        decode_leaves(node.tree, leaves)
+    elif isinstance(node, Tree):
+        for b, s in sorted(node.subs):
+            decode_leaves(s, leaves)
+    elif isinstance(node, IncMultiPattern):
+        for p in node.pats:
+            decode_leaves(p, leaves)
+    else:
+        leaves.append(node)
+# end decode_leaves
+
+
+def output_decode_union():
+    i4 = str_indent(4)
+    output(i4, 'union {\n')
+    for n in sorted(ctx.arguments.keys()):
+        f = ctx.arguments[n]
+        output(i4, i4, f.struct_name(), ' f_', f.name, ';\n')
+    output(i4, '} u;\n')
+
+
+def output_switch_decoder(toppat, decode_scope):
+    """Output the decode function as nested switch and if statements"""
+    output(decode_scope, 'bool ', ctx.decode_function,
+           '(rv_decode *dec, ', ctx.insntype, ' insn)\n{\n')
 
+    i4 = str_indent(4)
+
+    if len(ctx.allpatterns) != 0:
+        output_decode_union()
+        output('\n')
+        toppat.output_code(4, False, 0, 0)
+
+    output(i4, 'return false;\n')
+    output('}\n')
+# end output_switch_decoder
+
+
+def output_table_decoder(toppat, decode_scope):
+    """Output the decode function as a table of patterns to match in order.
+
+    Patterns outside of a group never overlap, so trying all patterns in
+    the order of the decode tree matches the same pattern as the switch
+    backend.  Only the top level switch of the tree is kept to select the
+    range of the table to search."""
+    if len(ctx.allpatterns) == 0:
+        output_switch_decoder(toppat, decode_scope)
+        return
+
+    leaves = []
+    ranges = []
+    tree = toppat.tree
+    if tree.thismask != 0:
+        for b, s in sorted(tree.subs):
+            start = len(leaves)
+            decode_leaves(s, leaves)
+            ranges.append((b, start, len(leaves)))
+    else:
+        decode_leaves(toppat, leaves)
+
+    # Deduplicate argument extraction and translate calls
+    extracts = {}
+    trans = {}
+    rows = []
+    for p in leaves:
+        code = capture(p.output_args, str_indent(12), False)
+        e = extracts.setdefault(code, len(extracts))
+        if p.name not in trans:
+            trans[p.name] = (len(trans), p.base.base.name)
+        rows.append((p, e, trans[p.name][0]))
+
+    entry = ctx.decode_function + '_entry'
+    output('typedef struct {\n',
+           f'    {ctx.insntype} mask;\n',
+           f'    {ctx.insntype} value;\n',
+           '    uint16_t extract;\n',
+           '    uint16_t trans;\n',
+           '} ', entry, ';\n\n')
+
+    output('static const ', entry, ' ', ctx.decode_function, '_table[] = {\n')
+    for p, e, t in rows:
+        output(f'    {{ {whexC(p.fixedmask)}, {whexC(p.fixedbits)}, {e}, {t} }},')
+        if ctx.comments:
+            output(f' /* {p.file}:{p.lineno} {p.name} */')
+        output('\n')
+    output('};\n\n')
+
+    output(decode_scope, 'bool ', ctx.decode_function,
+           '(rv_decode *dec, ', ctx.insntype, ' insn)\n{\n')
+    output_decode_union()
+    output(f'    unsigned i, start = 0, end = {len(rows)};\n\n')
+
+    if ranges:
+        sh = is_contiguous(tree.thismask)
+        if sh > 0:
+            output(f'    switch ((insn >> {sh}) & {tree.thismask >> sh:#x}) {{\n')
+        else:
+            output(f'    switch (insn & {whexC(tree.thismask)}) {{\n')
+        for b, start, end in ranges:
+            output('    case ', hex(b >> sh) if sh > 0 else whexC(b), ':\n',
+                   f'        start = {start};\n',
+                   f'        end = {end};\n',
+                   '        break;\n')
+        output('    default:\n',
+               '        return false;\n',
+               '    }\n\n')
+
+    output('    for (i = start; i < end; i++) {\n',
+           f'        const {entry} *e = &{ctx.decode_function}_table[i];\n',
+           '        if ((insn & e->mask) != e->value) {\n',
+           '            continue;\n',
+           '        }\n',
+           '        switch (e->extract) {\n')
+    for code, e in extracts.items():
+        output(f'        case {e}:\n', code, '            break;\n')
+    output('        }\n',
+           '        switch (e->trans) {\n')
+    for name, (t, arg) in trans.items():
+        output(f'        case {t}:\n',
+               f'            if ({ctx.translate_prefix}_{name}(dec, &u.f_{arg})) return true;\n',
+               '            break;\n')
+    output('        }\n',
+           '    }\n',
+           '    return false;\n',
+           '}\n')
+# end output_table_decoder
+
+
+decoder_backends = {
+    'switch': output_switch_decoder,
+    'table': output_table_decoder,
+}
+
+
+def read_profile(filename):
+    """Read an instruction frequency profile.
+
+    Either "name count" lines, or a QEMU log of -d in_asm in which case
+    every disassembled instruction counts once and other lines are
+    ignored."""
+    re_in_asm = re.compile(r'0x[0-9a-f]+:\s+[0-9a-f]+\s+([a-z][a-z0-9.]*)')
+    in_asm = False
+    with open(filename, 'rt', encoding='utf-8', errors='replace') as f:
+        for lineno, line in enumerate(f, 1):
+            m = re_in_asm.match(line)
+            if m:
+                name, count = m.group(1), 1
+                in_asm = True
+            elif line.startswith('IN:'):
+                in_asm = True
+                continue
+            elif in_asm or line.isspace() or \
+                 line.startswith(('---', 'OBJD-', 'Priv:')):
+                # Once the file is known to be an in_asm log, skip whatever
+                # else QEMU logs, e.g. "Priv: 3; Virt: 0" after each block
+                # in RISC-V system mode.
+                continue
+            else:
+                toks = line.split('#', 1)[0].split()
+                if not toks:
+                    continue
+                if len(toks) != 2 or not toks[1].isdigit():
+                    error_with_file(filename, lineno, 'expected "name count"')
+                name, count = toks[0], int(toks[1])
+            name = name.replace('.', '_')
+            ctx.profile[name] = ctx.profile.get(name, 0) + count
+# end read_profile
+
+
+def generate(argv):
+    """Generate one decoder from the command line arguments ARGV."""
     decode_scope = 'static '
 
     long_opts = ['decode=', 'translate=', 'output=', 'insnwidth=',
                  'static-decode=', 'varinsnwidth=', 'test-for-error',
-                 'output-null']
+                 'output-null', 'stats=', 'optimize-tree', 'profile=',
+                 'backend=', 'no-comments']
     try:
-        (opts, args) = getopt.gnu_getopt(sys.argv[1:], 'o:vw:', long_opts)
+        (opts, args) = getopt.gnu_getopt(argv, 'o:vw:', long_opts)
     except getopt.GetoptError as err:
         error(0, err)
     for o, a in opts:
         if o in ('-o', '--output'):
-            output_file = a
+            ctx.output_file = a
         elif o == '--decode':
-            decode_function = a
+            ctx.decode_function = a
             decode_scope = ''
         elif o == '--static-decode':
-            decode_function = a
+            ctx.decode_function = a
         elif o == '--translate':
-            translate_prefix = a
-            translate_scope = ''
+            ctx.translate_prefix = a
+            ctx.translate_scope = ''
         elif o in ('-w', '--insnwidth', '--varinsnwidth'):
             if o == '--varinsnwidth':
-                variablewidth = True
-            insnwidth = int(a)
-            if insnwidth == 16:
-                insntype = 'uint16_t'
-                insnmask = 0xffff
-            elif insnwidth == 64:
-                insntype = 'uint64_t'
-                insnmask = 0xffffffffffffffff
-                bitop_width = 64
-            elif insnwidth != 32:
-                error(0, 'cannot handle insns of width', insnwidth)
+                ctx.variablewidth = True
+            ctx.insnwidth = int(a)
+            if ctx.insnwidth == 16:
+                ctx.insntype = 'uint16_t'
+                ctx.insnmask = 0xffff
+            elif ctx.insnwidth == 64:
+                ctx.insntype = 'uint64_t'
+                ctx.insnmask = 0xffffffffffffffff
+                ctx.bitop_width = 64
+            elif ctx.insnwidth != 32:
+                error(0, 'cannot handle insns of width', ctx.insnwidth)
         elif o == '--test-for-error':
-            testforerror = True
+            ctx.testforerror = True
         elif o == '--output-null':
-            output_null = True
+            ctx.output_null = True
+        elif o == '--stats':
+            ctx.stats_file = a
+        elif o == '--optimize-tree':
+            ctx.optimize_tree = True
+        elif o == '--profile':
+            read_profile(a)
+        elif o == '--no-comments':
+            ctx.comments = False
+        elif o == '--backend':
+            if a not in decoder_backends:
+                error(0, 'unknown backend', a)
+            ctx.backend = a
         else:
             assert False, 'unhandled option'
 
@@ -1558,7 +2021,7 @@ def main():
     toppat = ExcMultiPattern(0)
 
     for filename in args:
-        input_file = filename
+        ctx.input_file = filename
         f = open(filename, 'rt', encoding='utf-8')
         parse_file(f, toppat)
         f.close()
@@ -1572,24 +2035,19 @@ def main():
     toppat.build_tree()
     toppat.prop_format()
 
-    if variablewidth:
+    stree = None
+    if ctx.variablewidth:
         for i in toppat.pats:
             i.prop_width()
         stree = build_size_tree(toppat.pats, 8, 0, 0)
         prop_size(stree)
 
-    if output_null:
-        output_fd = open(os.devnull, 'wt', encoding='utf-8', errors="ignore")
-    elif output_file:
-        output_fd = open(output_file, 'wt', encoding='utf-8')
-    else:
-        output_fd = io.TextIOWrapper(sys.stdout.buffer,
-                                     encoding=sys.stdout.encoding,
-                                     errors="ignore")
+    # Everything is generated into memory and written at the end.
+    ctx.output_fd = io.StringIO()
 
     output_autogen()
-    for n in sorted(arguments.keys()):
-        f = arguments[n]
+    for n in sorted(ctx.arguments.keys()):
+        f = ctx.arguments[n]
         f.output_def()
 
     # A single translate function can be invoked for different patterns.
@@ -1599,7 +2057,7 @@ def main():
     # If we're sharing formats, we're likely also sharing trans_* functions,
     # but we can't tell which ones.  Prevent issues from the compiler by
     # suppressing redundant declaration warnings.
-    if anyextern:
+    if ctx.anyextern:
         output("#pragma GCC diagnostic push\n",
                "#pragma GCC diagnostic ignored \"-Wredundant-decls\"\n",
                "#ifdef __clang__\n"
@@ -1607,7 +2065,7 @@ def main():
                "#endif\n\n")
 
     out_pats = {}
-    for i in allpatterns:
+    for i in ctx.allpatterns:
         if i.name in out_pats:
             p = out_pats[i.name]
             if i.base.base != p.base.base:
@@ -1617,39 +2075,95 @@ def main():
             out_pats[i.name] = i
     output('\n')
 
-    if anyextern:
+    if ctx.anyextern:
         output("#pragma GCC diagnostic pop\n\n")
 
-    for n in sorted(formats.keys()):
-        f = formats[n]
+    for n in sorted(ctx.formats.keys()):
+        f = ctx.formats[n]
         f.output_extract()
 
-    output(decode_scope, 'bool ', decode_function,
-           '(rv_decode *dec, ', insntype, ' insn)\n{\n')
-
-    i4 = str_indent(4)
-
-    if len(allpatterns) != 0:
-        output(i4, 'union {\n')
-        for n in sorted(arguments.keys()):
-            f = arguments[n]
-            output(i4, i4, f.struct_name(), ' f_', f.name, ';\n')
-        output(i4, '} u;\n\n')
-        toppat.output_code(4, False, 0, 0)
-
-    output(i4, 'return false;\n')
-    output('}\n')
+    decoder_backends[ctx.backend](toppat, decode_scope)
 
-    if variablewidth:
-        output('\n', decode_scope, insntype, ' ', decode_function,
+    if ctx.variablewidth:
+        output('\n', decode_scope, ctx.insntype, ' ', ctx.decode_function,
                '_load(rv_decode *dec)\n{\n',
-               '    ', insntype, ' insn = 0;\n\n')
+               '    ', ctx.insntype, ' insn = 0;\n\n')
         stree.output_code(4, 0, 0, 0)
         output('}\n')
 
-    if output_file:
-        output_fd.close()
-    exit(1 if testforerror else 0)
+    if ctx.stats_file:
+        output_stats(toppat, stree, decode_scope)
+
+    write_output(ctx.output_fd.getvalue())
+    exit(1 if ctx.testforerror else 0)
+# end generate
+
+
+def run_job(argv):
+    """Run generate() for ARGV in a fresh context, return its exit status."""
+    global ctx
+    ctx = DecodeContext()
+    try:
+        generate(argv)
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 1
+    return 0
+# end run_job
+
+
+def read_manifest(filename, argv):
+    """Read the jobs of a manifest file.
+
+    Every line holds the arguments of one decoder, as they would be passed
+    on the command line, and is prefixed with the options in ARGV."""
+    jobs = []
+    with open(filename, 'rt', encoding='utf-8') as f:
+        for line in f:
+            toks = shlex.split(line, comments=True)
+            if toks:
+                jobs.append(argv + toks)
+    return jobs
+# end read_manifest
+
+
+def main():
+    # --manifest and --jobs apply to the whole invocation, all other
+    # options are passed on to every job.
+    manifest = None
+    njobs = 1
+    argv = []
+    args = iter(sys.argv[1:])
+    for a in args:
+        o, eq, v = a.partition('=')
+        if a.startswith('-j') and len(a) > 2:
+            o, eq, v = '-j', '=', a[2:]
+        if o in ('--manifest', '--jobs', '-j'):
+            if not eq:
+                v = next(args, None)
+                if v is None:
+                    error(0, 'option', o, 'requires argument')
+            if o == '--manifest':
+                manifest = v
+            elif not v.isdigit() or int(v) < 1:
+                error(0, 'invalid number of jobs', v)
+            else:
+                njobs = int(v)
+        else:
+            argv.append(a)
+
+    if manifest is None:
+        exit(run_job(argv))
+
+    try:
+        jobs = read_manifest(manifest, argv)
+    except (OSError, ValueError) as e:
+        error_with_file(manifest, 0, e)
+    if njobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=njobs) as pool:
+            status = list(pool.map(run_job, jobs))
+    else:
+        status = [run_job(j) for j in jobs]
+    exit(max(status, default=0))
 # end main
 
 
@@ -0,0 +1,777 @@
+#
+# Parser for the IDL of UDB instruction operations, and translation of the
+# parsed operations to C++.
+#
+# Copyright (c) 2025 rev.ng Labs Srl.
+#
+# This work is licensed under the terms of the GNU GPL, version 2 or
+# (at your option) any later version.
+#
+# See the LICENSE file in the top-level directory for details.
+#
+
+import functools
+import re
+
+
+class IdlError(Exception):
+    """Raised for operations using IDL syntax the parser does not handle."""
+
+
+class Token:
+    """
+    A token of KIND with source TEXT. LEAD holds the whitespace and comments
+    preceding it, so that unmodified code can be emitted as written.
+    """
+
+    def __init__(self, kind, text, lead):
+        self.kind = kind
+        self.text = text
+        self.lead = lead
+
+    def __repr__(self):
+        return f'Token({self.kind}, {self.text!r})'
+
+
+class Node:
+    """
+    AST node of KIND. ITEMS holds the tokens and child nodes making up the
+    node in source order, named children are also stored as attributes.
+    """
+
+    def __init__(self, kind, items, **children):
+        self.kind = kind
+        self.items = items
+        self.__dict__.update(children)
+
+    def first(self):
+        """Return the first token of the node."""
+        item = self.items[0]
+        return item if isinstance(item, Token) else item.first()
+
+    def source(self):
+        """Return the source text of the node, without its leading trivia."""
+        return ''.join(t.lead + t.text for t in tokens(self))[len(self.first().lead):]
+
+    def __repr__(self):
+        return f'Node({self.kind}, {self.source()!r})'
+
+
+def tokens(node):
+    """Yield all tokens of NODE in source order."""
+    for item in node.items:
+        if isinstance(item, Token):
+            yield item
+        else:
+            yield from tokens(item)
+
+
+def walk(node):
+    """Yield NODE and all nodes below it, parents before children."""
+    yield node
+    for item in node.items:
+        if isinstance(item, Node):
+            yield from walk(item)
+
+
+################################################################################
+# Tokenizer
+
+re_token = re.compile(r'''
+    (?P<lead>(?:\s+|\#[^\n]*)*)
+    (?:
+        (?P<sized>[A-Za-z0-9]+'(?:b[0-9]+|h[0-9A-Fa-f]+))
+      | (?P<number>0x[0-9A-Fa-f_]+|0b[01_]+|[0-9]+)
+      | (?P<ident>\$?[A-Za-z_][A-Za-z0-9_]*(?:\?(?=\())?)
+      | (?P<string>"[^"\n]*")
+      | (?P<op>`(?:<<|>>|\+|-|\*)|>>>|<<|>>|<=|>=|==|!=|&&|\|\||::|\+\+|--
+              |[-+*/%&|^~!<>=?:;,.()\[\]{}])
+      | (?P<end>\Z)
+    )''', re.VERBOSE)
+
+
+def tokenize(text):
+    """Split TEXT into tokens, the last one is an 'end' token."""
+    result = []
+    match = re_token.match
+    pos = 0
+    while True:
+        m = match(text, pos)
+        if not m:
+            raise IdlError(f'unexpected character {text[pos:].lstrip()[:1]!r}')
+        kind = m.lastgroup
+        result.append(Token(kind, m[kind], m['lead']))
+        if kind == 'end':
+            return result
+        pos = m.end()
+
+
+################################################################################
+# Parser
+
+binary_precedence = {
+    '||': 1,
+    '&&': 2,
+    '|': 3,
+    '^': 4,
+    '&': 5,
+    '==': 6, '!=': 6,
+    '<': 7, '<=': 7, '>': 7, '>=': 7,
+    '<<': 8, '>>': 8, '>>>': 8, '`<<': 8, '`>>': 8,
+    '+': 9, '-': 9, '`+': 9, '`-': 9,
+    '*': 10, '/': 10, '%': 10, '`*': 10,
+}
+
+unary_ops = {'-', '+', '!', '~'}
+
+statement_keywords = {'if', 'else', 'for', 'return', 'raise'}
+
+postfix_ops = {'(', '[', '.', '::', '++', '--'}
+
+
+class Parser:
+    """Recursive descent parser over the tokens of one operation."""
+
+    def __init__(self, text):
+        self.toks = tokenize(text)
+        self.pos = 0
+        # Number of enclosing template argument lists, in which '>' closes
+        # the list instead of being a comparison.
+        self.in_template = 0
+
+    def peek(self, offset=0):
+        i = self.pos + offset
+        return self.toks[i] if i < len(self.toks) else self.toks[-1]
+
+    def at(self, text, offset=0):
+        t = self.peek(offset)
+        return t.text == text and t.kind in ('op', 'ident')
+
+    def next(self):
+        t = self.toks[self.pos]
+        if t.kind == 'end':
+            raise IdlError('unexpected end of operation')
+        self.pos += 1
+        return t
+
+    def expect(self, text):
+        t = self.next()
+        if t.text != text or t.kind not in ('op', 'ident'):
+            raise IdlError(f'expected {text!r}, got {t.text!r}')
+        return t
+
+    def parse_operation(self):
+        stmts = []
+        while self.peek().kind != 'end':
+            stmts.append(self.parse_statement())
+        return Node('operation', stmts + [self.peek()], body=stmts)
+
+    def parse_statement(self):
+        t = self.peek()
+        if self.at('{'):
+            items = [self.next()]
+            while not self.at('}'):
+                items.append(self.parse_statement())
+            items.append(self.next())
+            return Node('block', items)
+        if self.at('if'):
+            items = [self.next(), self.expect('(')]
+            cond = self.parse_expr()
+            items += [cond, self.expect(')')]
+            then = self.parse_statement()
+            items.append(then)
+            other = None
+            if self.at('else'):
+                items.append(self.next())
+                other = self.parse_statement()
+                items.append(other)
+            return Node('if', items, cond=cond, then=then, other=other)
+        if self.at('for'):
+            items = [self.next(), self.expect('(')]
+            init = self.parse_simple_statement()
+            cond = self.parse_expr()
+            items += [init, cond, self.expect(';')]
+            step = self.parse_simple()
+            items += [step, self.expect(')')]
+            body = self.parse_statement()
+            items.append(body)
+            return Node('for', items, init=init, cond=cond, step=step,
+                        body=body)
+        if self.at('return'):
+            items = [self.next()]
+            value = None
+            if not self.at(';'):
+                value = self.parse_expr()
+                items.append(value)
+            items.append(self.expect(';'))
+            return Node('return', items, value=value)
+        if self.at('raise') and (not self.at('(', 1) or self.peek(1).lead):
+            items = [self.next()]
+            what = self.parse_expr()
+            items += [what, self.expect('if')]
+            cond = self.parse_expr()
+            items += [cond, self.expect(';')]
+            return Node('raise_if', items, what=what, cond=cond)
+        return self.parse_simple_statement()
+
+    def parse_simple_statement(self):
+        """Parse a declaration, assignment or expression followed by ';'."""
+        if self.is_declaration():
+            return self.parse_declaration()
+        return self.parse_simple(';')
+
+    def parse_simple(self, end=None):
+        """Parse an assignment or expression, terminated by END if given."""
+        target = self.parse_expr()
+        if self.at('='):
+            items = [target, self.next()]
+            value = self.parse_expr()
+            items.append(value)
+            if end:
+                items.append(self.expect(end))
+            return Node('assign', items, target=target, value=value)
+        items = [target]
+        if end:
+            items.append(self.expect(end))
+        return Node('expr_stmt', items, expr=target)
+
+    def is_declaration(self):
+        t = self.peek()
+        if t.kind != 'ident' or t.text in statement_keywords:
+            return False
+        if t.text == 'Bits' and self.at('<', 1):
+            return True
+        n = self.peek(1)
+        return n.kind == 'ident' and n.text not in statement_keywords
+
+    def parse_declaration(self):
+        type = self.parse_type()
+        name = self.next()
+        if name.kind != 'ident':
+            raise IdlError(f'expected a name, got {name.text!r}')
+        items = [type, name]
+        value = None
+        if self.at('='):
+            items.append(self.next())
+            value = self.parse_expr()
+            items.append(value)
+        items.append(self.expect(';'))
+        return Node('declaration', items, type=type, name=name, value=value)
+
+    def parse_type(self):
+        name = self.next()
+        items = [name]
+        args = None
+        if self.at('<'):
+            args = self.parse_template_args()
+            items.append(args)
+        return Node('type', items, name=name, args=args)
+
+    def parse_template_args(self):
+        items = [self.expect('<')]
+        self.in_template += 1
+        args = [self.parse_expr()]
+        items.append(args[0])
+        while self.at(','):
+            items.append(self.next())
+            args.append(self.parse_expr())
+            items.append(args[-1])
+        self.in_template -= 1
+        items.append(self.expect('>'))
+        return Node('template_args', items, args=args)
+
+    def is_template_call(self):
+        """
+        Return whether the '<' at the current position opens the template
+        arguments of a call, as in read_memory<32>(...).
+        """
+        depth = 0
+        i = 1
+        while True:
+            t = self.peek(i)
+            if t.kind == 'end' or t.text in (';', '&&', '||'):
+                return False
+            if t.text in ('(', '[', '{'):
+                depth += 1
+            elif t.text in (')', ']', '}'):
+                depth -= 1
+                if depth < 0:
+                    return False
+            elif t.text == '>' and depth == 0:
+                return self.at('(', i + 1)
+            i += 1
+
+    def parse_expr(self):
+        cond = self.parse_binary(1)
+        if not self.at('?'):
+            return cond
+        items = [cond, self.next()]
+        then = self.parse_expr()
+        items += [then, self.expect(':')]
+        other = self.parse_expr()
+        items.append(other)
+        return Node('ternary', items, cond=cond, then=then, other=other)
+
+    def parse_binary(self, min_prec):
+        left = self.parse_unary()
+        while True:
+            t = self.peek()
+            prec = binary_precedence.get(t.text) if t.kind == 'op' else None
+            if prec is None or prec < min_prec:
+                return left
+            if self.in_template and t.text in ('>', '>=', '>>', '>>>'):
+                return left
+            op = self.next()
+            right = self.parse_binary(prec + 1)
+            left = Node('binary', [left, op, right], left=left, op=op,
+                        right=right)
+
+    def parse_unary(self):
+        t = self.peek()
+        if t.kind == 'op' and t.text in unary_ops:
+            op = self.next()
+            operand = self.parse_unary()
+            return Node('unary', [op, operand], op=op, operand=operand)
+        return self.parse_postfix(self.parse_primary())
+
+    def parse_postfix(self, expr):
+        while True:
+            t = self.peek()
+            if t.kind != 'op' or t.text not in postfix_ops:
+                return expr
+            if t.text == '(':
+                items = [expr, self.next()]
+                args = []
+                while not self.at(')'):
+                    if args:
+                        items.append(self.expect(','))
+                    args.append(self.parse_expr())
+                    items.append(args[-1])
+                items.append(self.next())
+                expr = Node('call', items, func=expr, args=args)
+            elif t.text == '[':
+                items = [expr, self.next()]
+                saved, self.in_template = self.in_template, 0
+                index = self.parse_expr()
+                items.append(index)
+                if self.at(':'):
+                    items.append(self.next())
+                    low = self.parse_expr()
+                    items += [low, self.expect(']')]
+                    expr = Node('slice', items, base=expr, high=index, low=low)
+                else:
+                    items.append(self.expect(']'))
+                    expr = Node('index', items, base=expr, index=index)
+                self.in_template = saved
+            elif t.text == '.' and self.peek(1).kind == 'ident':
+                dot = self.next()
+                member = self.next()
+                expr = Node('member', [expr, dot, member], base=expr,
+                            member=member)
+            elif t.text == '::' and self.peek(1).kind == 'ident':
+                sep = self.next()
+                member = self.next()
+                expr = Node('scope', [expr, sep, member], base=expr,
+                            member=member)
+            elif t.text in ('++', '--'):
+                expr = Node('postfix', [expr, self.next()], operand=expr)
+            else:
+                return expr
+
+    def parse_primary(self):
+        t = self.next()
+        if t.kind == 'ident':
+            if t.text in statement_keywords and not self.at('('):
+                raise IdlError(f'unexpected {t.text!r}')
+            if self.at('<') and (t.text == 'Bits' or self.is_template_call()):
+                args = self.parse_template_args()
+                return Node('template', [t, args], name=t, args=args)
+            return Node('name', [t], name=t)
+        if t.kind in ('number', 'sized', 'string'):
+            return Node(t.kind, [t], value=t)
+        if t.text == '(':
+            saved, self.in_template = self.in_template, 0
+            expr = self.parse_expr()
+            self.in_template = saved
+            return Node('paren', [t, expr, self.expect(')')], expr=expr)
+        if t.text == '{':
+            saved, self.in_template = self.in_template, 0
+            first = self.parse_expr()
+            if self.at('{'):
+                inner = self.next()
+                value = self.parse_expr()
+                items = [t, first, inner, value, self.expect('}'),
+                         self.expect('}')]
+                self.in_template = saved
+                return Node('replicate', items, count=first, value=value)
+            items = [t, first]
+            parts = [first]
+            while self.at(','):
+                items.append(self.next())
+                parts.append(self.parse_expr())
+                items.append(parts[-1])
+            items.append(self.expect('}'))
+            self.in_template = saved
+            return Node('concat', items, parts=parts)
+        raise IdlError(f'unexpected {t.text!r}')
+
+
+def operand_roles(ast):
+    """
+    Return a dict from names to the set of roles they are used in by the
+    operation AST: 'gpr' for X[name], 'gpr+8' for X[name+8], 'creg' for
+    creg2reg(name), 'creg+8' for creg2reg(name+8) and 'signed' for
+    $signed(name).
+    """
+    roles = {}
+
+    def operand(node, role):
+        if node.kind == 'name':
+            roles.setdefault(node.name.text, set()).add(role)
+        elif node.kind == 'binary' and node.op.text == '+' and \
+                node.left.kind == 'name' and node.right.kind == 'number' and \
+                node.right.value.text == '8':
+            roles.setdefault(node.left.name.text, set()).add(role + '+8')
+
+    for node in walk(ast):
+        if node.kind == 'index' and node.base.kind == 'name' and \
+                node.base.name.text == 'X':
+            operand(node.index, 'gpr')
+        elif node.kind == 'call' and node.func.kind == 'name' and \
+                len(node.args) == 1:
+            func = node.func.name.text
+            if func == 'creg2reg':
+                operand(node.args[0], 'creg')
+            elif func == '$signed' and node.args[0].kind == 'name':
+                operand(node.args[0], 'signed')
+    return roles
+
+
+def join_statement_lines(op):
+    """
+    Join statements spanning multiple lines and drop empty lines, as the
+    C++ translation works line by line.
+    """
+    processed_op = ""
+    for line in op.splitlines():
+        if len(line) == 0:
+            continue
+        stripped_line = line.rstrip()
+        if not '#' in stripped_line and not stripped_line[-1] in {'{', ';', '}'}:
+            processed_op += stripped_line
+        else:
+            processed_op += stripped_line + '\n'
+    return processed_op
+
+
+@functools.lru_cache(maxsize=None)
+def parse(op):
+    """
+    Parse the operation() body OP, raises IdlError for unsupported syntax.
+    The AST is cached, and must not be modified.
+    """
+    return Parser(join_statement_lines(op)).parse_operation()
+
+
+################################################################################
+# C++ emission
+
+# Texts of the bounds of a slice, and of the count and value of a
+# replication, translated to C++.
+re_slice_bound = re.compile(r'[A-Za-z0-9\(\)\+\-\*/ ]+')
+re_repeat_count = re.compile(r'[A-Za-z0-9\(\)\+\-\*/ ]+')
+re_repeat_value = re.compile(r'[A-Za-z0-9\(\)\[\]<>\+\-\*/, ]+')
+re_wide_shl_operand = re.compile(r'[A-Za-z0-9_ ]+')
+re_jump_halfword = re.compile(r'xqci_current_pc\(\)[ ]+\+[ ]+([a-z_A-Z\(\)]+)')
+re_jump_target = re.compile(r'[a-z_A-Z0-9\[\]]+')
+re_trailing_ident = re.compile(r'[_a-zA-Z0-9]+$')
+
+renamed_idents = {
+    '$signed': '_signed',
+    '$encoding': '0',
+    '$bits': 'XReg',
+    '$pc': 'xqci_current_pc()',
+}
+
+wide_ops = {'`+': 'wide_add', '`-': 'wide_sub'}
+
+# Declarations of 64-bit register pairs, replaced verbatim.
+pair_declarations = {
+    "Bits<{1'b0, XLEN}*2> pair = {X[rs1 + 1], X[rs1]};",
+    "Bits<{1'b0, MXLEN}*2> pair = {X[rs1 + 1], X[rs1]};",
+}
+pair_cpp = 'uint64_t pair = ((uint64_t) X[rs1+1].value() << 32) | ((uint64_t) X[rs1].value());'
+
+
+def scoped_name(node, scope):
+    """Return X if NODE is SCOPE::X, otherwise None."""
+    if node.kind == 'scope' and node.base.kind == 'name' and \
+            node.base.name.text == scope and node.member.text.isalpha():
+        return node.member.text
+    return None
+
+
+def csr_index(node):
+    """Return the index expression E if NODE is CSR[E], otherwise None."""
+    if node.kind == 'index' and node.base.kind == 'name' and \
+            node.base.name.text == 'CSR':
+        return node.index
+    return None
+
+
+def gpr_index(node):
+    """
+    Return the index expression E if NODE is X[E], or a slice or member
+    of it, otherwise None.
+    """
+    while node.kind in ('slice', 'member'):
+        node = node.base
+    if node.kind == 'index' and node.base.kind == 'name' and \
+            node.base.name.text == 'X':
+        return node.index
+    return None
+
+
+class CppEmitter:
+    """
+    Translate an operation AST to C++ for helper-to-tcg, or for KLEE if
+    FOR_KLEE. Dotted names of CSRS are turned into C++ identifiers. Code
+    which is not translated is emitted as written.
+    """
+
+    def __init__(self, csrs, for_klee):
+        self.csrs = csrs
+        self.for_klee = for_klee
+        self.in_bits = 0
+
+    def emit(self, item, lead=True):
+        """Return the C++ for ITEM, with its leading trivia if LEAD."""
+        if isinstance(item, Token):
+            return (self.trivia(item.lead) if lead else '') + self.token(item)
+        handler = getattr(self, f'emit_{item.kind}', None)
+        text = handler(item) if handler else None
+        if text is None:
+            return self.emit_items(item.items, lead)
+        return (self.trivia(item.first().lead) if lead else '') + text
+
+    def emit_items(self, items, lead=False):
+        return ''.join(self.emit(item, lead or i > 0)
+                       for i, item in enumerate(items))
+
+    def text(self, item):
+        """Return the C++ for ITEM, without its leading trivia."""
+        return self.emit(item, False)
+
+    def trivia(self, lead):
+        return lead.replace('#', '//')
+
+    def token(self, t):
+        if t.kind == 'ident':
+            return renamed_idents.get(t.text, t.text)
+        if t.kind == 'sized':
+            width, value = t.text.split("'")
+            base = '0b' if value[0] == 'b' else '0x'
+            return f'Bits<{width}>({base}{value[1:]})'
+        if t.text == '`*' and self.in_bits:
+            return '*'
+        return t.text
+
+    # Statements
+
+    def emit_for(self, node):
+        if node.items[1].lead != ' ':
+            return None
+        return '#pragma unroll\n' + self.emit_items(node.items)
+
+    def emit_raise_if(self, node):
+        return f'// {self.text(node.what)}'
+
+    def value(self, node):
+        """Return the C++ for NODE, the value of an assignment."""
+        if node.kind == 'binary' and node.op.text in wide_ops:
+            return (f'{wide_ops[node.op.text]}({self.text(node.left)}, '
+                    f'{self.text(node.right)})')
+        return self.text(node)
+
+    def emit_declaration(self, node):
+        if node.source() in pair_declarations:
+            return pair_cpp
+        # XReg x = cond ? {a} : {b};
+        value = node.value
+        if node.type.name.text == 'XReg' and value is not None and \
+                value.kind == 'ternary' and value.then.kind == 'concat' and \
+                value.other.kind == 'concat':
+            def braced(n):
+                return f'XReg({self.emit_items(n.items[1:-1], True)})'
+            return (self.emit_items(node.items[:-2]) +
+                    self.emit(value.cond) + self.emit(value.items[1]) +
+                    f' {braced(value.then)} : {braced(value.other)};')
+        if value is not None and value.kind == 'binary' and \
+                value.op.text in wide_ops:
+            return (self.emit_items(node.items[:-2]) +
+                    self.trivia(value.first().lead) + self.value(value) +
+                    self.emit(node.items[-1]))
+        return None
+
+    def emit_expr_stmt(self, node):
+        call = node.expr
+        if call.kind != 'call' or call.func.kind != 'name' or \
+                len(node.items) != 2:
+            return None
+        func = call.func.name.text
+        if func == 'raise' and len(call.args) >= 2:
+            code = scoped_name(call.args[0], 'ExceptionCode')
+            if code is not None:
+                return f'xqci_raise_{code}();'
+        elif func == 'set_mode' and len(call.args) == 1:
+            mode = scoped_name(call.args[0], 'PrivilegeMode')
+            if mode is not None:
+                return f'xqci_set_mode_{mode}();'
+        return None
+
+    def emit_assign(self, node):
+        target = node.target
+        value = node.value
+        end = self.emit(node.items[3]) if len(node.items) > 3 else ''
+        value_text = self.value(value)
+
+        if target.kind == 'member':
+            csr = csr_index(target.base)
+            if csr is not None and target.member.text.isupper():
+                csr = self.text(csr)
+                return (f'xqci_csrw_field_xreg(this, {csr}, '
+                        f'{csr.upper()}_{target.member.text}, {value_text}){end}')
+
+        if not self.for_klee:
+            index = gpr_index(target)
+            if index is not None:
+                return f'xqci_set_gpr_xreg({self.text(index)}, {value_text}){end}'
+
+        return (self.operand(target, node.items[1]) + self.emit(node.items[1]) +
+                self.trivia(value.first().lead) + value_text + end)
+
+    # Expressions
+
+    def operand(self, node, op):
+        """Return the C++ for NODE, the left operand of the OP token."""
+        # Assignments and comparisons of $pc use the pc variable.
+        if node.kind == 'name' and node.name.text == '$pc' and \
+                op.text in ('=', '==') and op.lead == ' ':
+            return 'pc'
+        return self.text(node)
+
+    def emit_binary(self, node):
+        if node.left.kind != 'name':
+            return None
+        return (self.operand(node.left, node.op) +
+                self.emit_items(node.items[1:], True))
+
+    def emit_member(self, node):
+        name = node.source()
+        if name in self.csrs:
+            return name.replace('.', '_')
+        csr = csr_index(node.base)
+        if csr is not None and node.member.text.isupper():
+            csr = self.text(csr)
+            return (f'xqci_csrr_field_xreg(this, {csr}, '
+                    f'{csr.upper()}_{node.member.text})')
+        return None
+
+    def emit_index(self, node):
+        csr = csr_index(node)
+        if csr is not None:
+            return f'xqci_csrr_xreg(this, {self.text(csr)})'
+        return None
+
+    def emit_slice(self, node):
+        high = self.text(node.high)
+        low = self.text(node.low)
+        if not re_slice_bound.fullmatch(high) or \
+                not re_slice_bound.fullmatch(low):
+            return None
+        base = self.text(node.base)
+        m = re_trailing_ident.search(base)
+        if m:
+            base = f'{base[:m.start()]}XReg({m.group(0)})'
+        return f'{base}.range<{low},{high}>()'
+
+    def emit_call(self, node):
+        func = node.func
+        if func.kind == 'member':
+            csr = csr_index(func.base)
+            if csr is None:
+                return None
+            method = func.member.text
+            if method == 'sw_read' and not node.args:
+                return f'xqci_csrr_xreg(this, {self.text(csr)})'
+            if method == 'sw_write' and len(node.args) == 1:
+                return (f'xqci_csrw_xreg(this, {self.text(csr)}, '
+                        f'{self.text(node.args[0])})')
+            if method == 'address' and not node.args:
+                name = self.text(csr)
+                assert name.startswith('qc') and not ' ' in name
+                return name
+            return None
+        if func.kind != 'name':
+            return None
+
+        name = func.name.text
+        if name in ('csr_sw_write', 'csr_sw_read'):
+            return f'{name}(this, {self.emit_items(node.items[2:], True)}'
+        if name == 'implemented?' and len(node.args) == 1:
+            ext = scoped_name(node.args[0], 'ExtensionName')
+            if ext is not None:
+                return f'xqci_implemented_{ext}()'
+        if name == 'jump_halfword' and len(node.args) == 1:
+            m = re_jump_halfword.fullmatch(self.text(node.args[0]))
+            if m:
+                return f'xqci_jump_pcrel_bits(maybe_sext_xreg({m.group(1)}))'
+        if name == 'jump' and len(node.args) == 1:
+            target = self.text(node.args[0])
+            if re_jump_target.fullmatch(target):
+                return f'xqci_jump({target}, 0)'
+        return None
+
+    def emit_template(self, node):
+        if node.name.text != 'Bits':
+            return None
+        # Backtick operators in widths, as in Bits<xlen()`*2>, compute the
+        # same value as the plain ones.
+        self.in_bits += 1
+        text = self.emit_items(node.items)
+        self.in_bits -= 1
+        return text
+
+    def emit_type(self, node):
+        return self.emit_template(node)
+
+    def emit_paren(self, node):
+        # (value `<< amount)
+        expr = node.expr
+        if expr.kind != 'binary' or expr.op.text != '`<<':
+            return None
+        value = self.emit(expr.left) + self.trivia(expr.op.lead)
+        amount = self.emit(expr.right) + self.trivia(node.items[-1].lead)
+        if not re_wide_shl_operand.fullmatch(value) or \
+                not re_wide_shl_operand.fullmatch(amount):
+            return None
+        return f'wide_shl<{amount}>({value})'
+
+    def emit_replicate(self, node):
+        count = self.emit(node.count) + self.trivia(node.items[2].lead)
+        value = self.emit(node.value) + self.trivia(node.items[4].lead)
+        if node.items[5].lead or \
+                not re_repeat_count.fullmatch(count) or \
+                not re_repeat_value.fullmatch(value):
+            return None
+        return f'repeat<{count}>({value})'
+
+
+@functools.lru_cache(maxsize=None)
+def to_cpp(ast, csrs, for_klee=False):
+    """
+    Translate the operation AST to C++, for helper-to-tcg or for KLEE if
+    FOR_KLEE. CSRS is a frozenset of the dotted CSR names which can be
+    referenced.
+    """
+    return CppEmitter(csrs, for_klee).emit(ast)
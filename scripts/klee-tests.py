@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+
+#
+# Runs the KLEE test generation pipeline for every instruction of a KLEE
+# input directory produced by udb-to-klee.py: compile to LLVM IR, run KLEE,
+# compile the replay executable, and collect the inputs/outputs of every
+# test found. Instructions are processed concurrently.
+#
+# Copyright (c) 2025 rev.ng Labs Srl.
+#
+# This work is licensed under the terms of the GNU GPL, version 2 or
+# (at your option) any later version.
+#
+# See the LICENSE file in the top-level directory for details.
+#
+
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+
+stages = ['cache', 'bc', 'klee', 'exe', 'replay']
+
+include_args = ['-I', 'cpp-templates', '-I', 'include', '-I', 'build']
+
+budget_options = ['max-time', 'max-memory', 'max-instructions']
+
+# Search heuristics tried, in order, when a KLEE run hits its budget.
+default_retry_searches = ['nurs:covnew', 'dfs']
+
+
+class StageError(Exception):
+    pass
+
+
+class Job:
+    """Test generation pipeline of one instruction."""
+
+    def __init__(self, dir, cpp, budget):
+        self.cpp = cpp
+        self.name = os.path.splitext(os.path.basename(cpp))[0]
+        self.budget = budget
+        self.bc = os.path.join(dir, 'bc', f'{self.name}.bc')
+        self.klee_out = os.path.join(dir, 'out', self.name)
+        self.klee_outs = [self.klee_out]
+        self.exe = os.path.join(dir, 'exes', self.name)
+        self.io = os.path.join(dir, 'io', self.name)
+        self.log_path = os.path.join(dir, 'logs', f'{self.name}.log')
+        self.times = {}
+        self.tests = 0
+        self.budget_hits = []
+        self.cached = False
+        self.error = None
+
+    def run(self, stage, cmd, stdout=None):
+        """Run CMD as STAGE, with all output going to the job's log."""
+        start = time.monotonic()
+        self.log.write(f'$ {" ".join(cmd)}\n')
+        self.log.flush()
+        result = subprocess.run(cmd,
+                                stdout=stdout or self.log,
+                                stderr=self.log)
+        self.times[stage] = self.times.get(stage, 0) + time.monotonic() - start
+        if result.returncode != 0:
+            raise StageError(f'{stage} failed with exit status {result.returncode}')
+
+    def ktests(self):
+        return [test for out in self.klee_outs
+                for test in sorted(glob.glob(os.path.join(out, '*.ktest')))]
+
+
+def load_budgets(path):
+    """
+    Load KLEE budgets from the YAML file PATH, of the form
+
+        default:
+          max-time: 10min
+          max-memory: 4000
+        instructions:
+          qc.shlsat:
+            max-time: 30min
+            retry-searches: [dfs]
+
+    Each entry may set any of the KLEE options max-time, max-memory (in MB)
+    and max-instructions, along with the search heuristics to retry with
+    when a run hits its budget. Instruction entries override the default.
+    """
+    try:
+        with open(path) as f:
+            config = yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError) as e:
+        print(f'Failed to load budgets {path}: {e}', file=sys.stderr)
+        exit(1)
+
+    entries = [config.get('default') or {}]
+    entries += (config.get('instructions') or {}).values()
+    for entry in entries:
+        for key in entry:
+            if key not in budget_options + ['retry-searches']:
+                print(f'Unknown KLEE budget option {key} in {path}',
+                      file=sys.stderr)
+                exit(1)
+    return config
+
+
+def instruction_budget(budgets, name):
+    budget = {'retry-searches': default_retry_searches}
+    budget.update(budgets.get('default') or {})
+    budget.update((budgets.get('instructions') or {}).get(name) or {})
+    return budget
+
+
+def klee_budget_args(budget):
+    args = []
+    for option in budget_options:
+        if option not in budget:
+            continue
+        value = budget[option]
+        # Plain numbers of seconds are accepted for max-time.
+        if option == 'max-time' and isinstance(value, (int, float)):
+            value = f'{value}s'
+        args.append(f'--{option}={value}')
+    return args
+
+
+def budget_hit(job, log, out):
+    """Return which budget the KLEE run logged in LOG stopped on, if any."""
+    if 'HaltTimer invoked' in log:
+        return 'max-time'
+    if 'over memory cap' in log or 'Memory cap exceeded' in log:
+        return 'max-memory'
+    if 'max-instructions' in job.budget:
+        try:
+            with open(os.path.join(out, 'info')) as f:
+                info = f.read()
+        except OSError:
+            return None
+        match = re.search(r'total instructions = (\d+)', info)
+        if match and int(match.group(1)) >= int(job.budget['max-instructions']):
+            return 'max-instructions'
+    return None
+
+
+def compile_bc(job, args):
+    job.run('bc', [args.clangpp, job.cpp, '-std=c++20', '-emit-llvm', '-c',
+                   '-g', '-O0', '-Xclang', '-disable-O0-optnone',
+                   *include_args, '-o', job.bc])
+
+
+def run_klee(job, args):
+    searches = [None] + list(job.budget['retry-searches'])
+    job.klee_outs = []
+    for search in searches:
+        out = job.klee_out if search is None else \
+            f'{job.klee_out}.{search.replace(":", "-")}'
+        # KLEE refuses to reuse an existing output directory.
+        shutil.rmtree(out, ignore_errors=True)
+        job.klee_outs.append(out)
+
+        job.log.flush()
+        start = job.log.tell()
+        job.run('klee', [args.klee,
+                         '--external-calls=all',
+                         '--only-output-states-covering-new',
+                         '--libc=uclibc',
+                         '--posix-runtime',
+                         *klee_budget_args(job.budget),
+                         *([f'--search={search}'] if search else []),
+                         f'--output-dir={out}',
+                         job.bc])
+        with open(job.log_path) as f:
+            f.seek(start)
+            hit = budget_hit(job, f.read(), out)
+        if hit is None:
+            break
+        # The tests found so far are kept and replayed along with those of
+        # the retries.
+        job.budget_hits.append({'search': search or 'default', 'budget': hit})
+
+
+def compile_exe(job, args):
+    job.run('exe', [args.clangpp, job.cpp, '-std=c++20', '-g',
+                    '-DKLEE_REPLAY', '-lkleeRuntest', *include_args, '-o', job.exe])
+
+
+def replay(job, args):
+    # All tests of all KLEE runs are replayed by a single process.
+    job.run('replay', [os.path.abspath(job.exe), '-o', job.io,
+                       *job.klee_outs])
+    job.tests = len(job.ktests())
+
+
+def tool_version(tool):
+    try:
+        result = subprocess.run([tool, '--version'], capture_output=True)
+    except OSError:
+        return b''
+    return result.stdout + result.stderr
+
+
+class ResultCache:
+    """
+    Content-addressed store of the KLEE tests and replayed io file of
+    instructions, keyed by everything the results depend on: the KLEE
+    input, the headers it includes, the clang and KLEE versions, the
+    instruction's budget, and this script.
+    """
+
+    def __init__(self, dir, args):
+        self.dir = dir
+        h = hashlib.sha256()
+        h.update(tool_version(args.clangpp))
+        h.update(tool_version(args.klee))
+        headers = sorted(glob.glob('cpp-templates/*.h') +
+                         glob.glob('include/*.h'))
+        for path in headers + [__file__]:
+            h.update(path.encode())
+            with open(path, 'rb') as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        self.inputs = h.digest()
+
+    def key(self, job):
+        h = hashlib.sha256(self.inputs)
+        with open(job.cpp, 'rb') as f:
+            h.update(f.read())
+        h.update(json.dumps(job.budget, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.dir, key[:2], key)
+
+    def restore(self, job, key):
+        """Restore the results of JOB from the cache, False on a miss."""
+        path = self.path(key)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        job.klee_outs = []
+        for run in meta['runs']:
+            out = os.path.join(os.path.dirname(job.klee_out), run)
+            shutil.rmtree(out, ignore_errors=True)
+            shutil.copytree(os.path.join(path, 'out', run), out)
+            job.klee_outs.append(out)
+        shutil.copyfile(os.path.join(path, 'io'), job.io)
+        job.tests = meta['tests']
+        job.budget_hits = meta['budget_hits']
+        job.cached = True
+        return True
+
+    def store(self, job, key):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Entries are populated under a temporary name and renamed into
+        # place, so runners sharing the cache never see partial entries.
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(path))
+        runs = [os.path.basename(out) for out in job.klee_outs]
+        for out, run in zip(job.klee_outs, runs):
+            os.makedirs(os.path.join(tmp, 'out', run))
+            for test in glob.glob(os.path.join(out, '*.ktest')):
+                shutil.copy(test, os.path.join(tmp, 'out', run))
+        shutil.copyfile(job.io, os.path.join(tmp, 'io'))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'name': job.name, 'runs': runs, 'tests': job.tests,
+                       'budget_hits': job.budget_hits}, f, indent=2)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Stored concurrently by another job or runner.
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def run_job(job, args, cache):
+    with open(job.log_path, 'w') as job.log:
+        try:
+            if cache is not None:
+                start = time.monotonic()
+                key = cache.key(job)
+                hit = cache.restore(job, key)
+                job.times['cache'] = time.monotonic() - start
+                if hit:
+                    job.log.write(f'restored from cache {cache.path(key)}\n')
+                    return job
+            for stage in (compile_bc, run_klee, compile_exe, replay):
+                stage(job, args)
+            if cache is not None:
+                cache.store(job, key)
+        except (StageError, OSError) as e:
+            job.error = str(e)
+            job.log.write(f'error: {e}\n')
+    return job
+
+
+def load_history(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def schedule(jobs, history):
+    """
+    Order JOBS so that the longest KLEE runs start first. Instructions
+    without a recorded KLEE time are assumed to be long and go first,
+    largest input first.
+    """
+    def key(job):
+        if job.name in history:
+            return (1, -history[job.name])
+        return (0, -os.path.getsize(job.cpp))
+    return sorted(jobs, key=key)
+
+
+def write_summary(path, jobs, elapsed):
+    summary = {
+        'elapsed': elapsed,
+        'instructions': {
+            job.name: {
+                'times': job.times,
+                'tests': job.tests,
+                'budget_hits': job.budget_hits,
+                'cached': job.cached,
+                'error': job.error,
+            } for job in sorted(jobs, key=lambda job: job.name)
+        },
+    }
+    with open(path, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+
+def print_summary(jobs, elapsed):
+    print('Stage wall time (summed over instructions):')
+    for stage in stages:
+        total = sum(job.times.get(stage, 0) for job in jobs)
+        print(f'  {stage:8} {total:10.1f} s')
+    ran = [job for job in jobs if 'klee' in job.times]
+    if ran:
+        slowest = max(ran, key=lambda job: job.times['klee'])
+        print(f'  slowest KLEE run: {slowest.name} '
+              f'({slowest.times["klee"]:.1f} s)')
+    print(f'Elapsed: {elapsed:.1f} s, '
+          f'{sum(job.tests for job in jobs)} tests, '
+          f'{sum(job.cached for job in jobs)} instruction(s) from cache')
+    hits = [job for job in jobs if job.budget_hits]
+    if hits:
+        print(f'{len(hits)} instruction(s) hit their KLEE budget:')
+        for job in hits:
+            runs = ', '.join(f'{hit["budget"]} with {hit["search"]} search'
+                             for hit in job.budget_hits)
+            print(f'  {job.name}: {runs}')
+    failed = [job for job in jobs if job.error]
+    if failed:
+        print(f'{len(failed)} instruction(s) failed, see logs:')
+        for job in failed:
+            print(f'  {job.name}: {job.error} ({job.log_path})')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='klee-tests.py',
+        description='Generate per-instruction tests from KLEE input produced by udb-to-klee.py'
+    )
+    parser.add_argument('dir',
+                        help='KLEE input directory, e.g. build/klee/xqci')
+    parser.add_argument('--clangpp', default='clang++',
+                        help='clang++ compatible with the KLEE version used')
+    parser.add_argument('--klee', default='klee')
+    parser.add_argument('--budgets',
+                        help='YAML file of per-instruction KLEE time, memory and instruction budgets')
+    parser.add_argument('--cache-dir', default=os.environ.get('UDB_KLEE_CACHE'),
+                        help='Directory of cached KLEE results, which may be shared between builds (default: $UDB_KLEE_CACHE, no caching if unset)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of instructions processed concurrently')
+    args = parser.parse_args()
+
+    for d in ('bc', 'out', 'exes', 'io', 'logs'):
+        os.makedirs(os.path.join(args.dir, d), exist_ok=True)
+
+    # KLEE times of the previous run, used to start the longest runs first.
+    history_path = os.path.join(args.dir, 'klee-times.json')
+    history = load_history(history_path)
+
+    budgets = load_budgets(args.budgets) if args.budgets else {}
+    jobs = [Job(args.dir, cpp,
+                instruction_budget(budgets,
+                                   os.path.splitext(os.path.basename(cpp))[0]))
+            for cpp in sorted(glob.glob(os.path.join(args.dir, '*.cpp')))]
+    jobs = schedule(jobs, history)
+
+    cache = ResultCache(args.cache_dir, args) if args.cache_dir else None
+
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max(args.jobs, 1)) as pool:
+        futures = [pool.submit(run_job, job, args, cache) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            job = future.result()
+            total = sum(job.times.values())
+            status = f'failed: {job.error}' if job.error else f'{job.tests} tests'
+            if job.cached:
+                status += ', cached'
+            print(f'  {job.name}: {status} ({total:.1f} s)', flush=True)
+    elapsed = time.monotonic() - start
+
+    history.update({job.name: job.times['klee']
+                    for job in jobs if 'klee' in job.times and not job.error})
+    with open(history_path, 'w') as f:
+        json.dump(history, f, indent=2, sort_keys=True)
+
+    write_summary(os.path.join(args.dir, 'klee-summary.json'), jobs, elapsed)
+    print_summary(jobs, elapsed)
+    if any(job.error for job in jobs):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
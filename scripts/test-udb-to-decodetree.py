@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+#
+# Tests of the grouping of overlapping instruction encodings done by
+# udb-to-decodetree.py. Run with
+#
+#   python3 -m unittest scripts/test-udb-to-decodetree.py
+#
+# Copyright (c) 2025 rev.ng Labs Srl.
+#
+# This work is licensed under the terms of the GNU GPL, version 2 or
+# (at your option) any later version.
+#
+# See the LICENSE file in the top-level directory for details.
+#
+
+import importlib.util
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+spec = importlib.util.spec_from_file_location(
+    'udb_to_decodetree',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 'udb-to-decodetree.py'))
+decodetree = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(decodetree)
+
+
+class DisjointSetTest(unittest.TestCase):
+
+    def test_singletons(self):
+        s = decodetree.DisjointSet(3)
+        self.assertEqual(s.groups(), [[0], [1], [2]])
+
+    def test_merge_existing_sets(self):
+        # A~B and C~D are separate sets until B~C joins them.
+        s = decodetree.DisjointSet(5)
+        s.union(0, 1)
+        s.union(2, 3)
+        self.assertEqual(sorted(s.groups()), [[0, 1], [2, 3], [4]])
+        s.union(1, 2)
+        self.assertEqual(sorted(s.groups()), [[0, 1, 2, 3], [4]])
+        self.assertEqual(s.find(0), s.find(3))
+        self.assertNotEqual(s.find(0), s.find(4))
+
+    def test_union_is_idempotent(self):
+        s = decodetree.DisjointSet(2)
+        s.union(0, 1)
+        s.union(1, 0)
+        s.union(0, 1)
+        self.assertEqual(s.groups(), [[0, 1]])
+
+
+class OverlapGroupsTest(unittest.TestCase):
+
+    def test_disjoint(self):
+        names = ['a', 'b', 'c']
+        matches = ['00--', '01--', '1---']
+        self.assertEqual(decodetree.overlap_groups(names, matches), names)
+
+    def test_transitive_group(self):
+        # a and c do not overlap, but both overlap with b.
+        names = ['a', 'b', 'c', 'd']
+        matches = ['0-0-', '0---', '011-', '1111']
+        self.assertEqual(decodetree.overlap_groups(names, matches),
+                         ['d', ['c', 'a', 'b']])
+
+    def test_most_specific_first(self):
+        names = ['any', 'two', 'three', 'one']
+        matches = ['----', '10--', '101-', '1---']
+        self.assertEqual(decodetree.overlap_groups(names, matches),
+                         [['three', 'two', 'one', 'any']])
+
+    def test_ties_keep_spec_order(self):
+        names = ['x', 'y', 'z', 'w']
+        matches = ['1-0-', '1--0', '11--', '----']
+        self.assertEqual(decodetree.overlap_groups(names, matches),
+                         [['x', 'y', 'z', 'w']])
+
+    def test_each_instruction_in_one_group(self):
+        names = [f'i{i}' for i in range(16)]
+        matches = [f'{i:04b}'[:2] + '--' if i % 3 == 0 else f'{i:04b}'
+                   for i in range(16)]
+        result = decodetree.overlap_groups(names, matches)
+        flat = []
+        for entry in result:
+            flat.extend(entry if isinstance(entry, list) else [entry])
+        self.assertEqual(sorted(flat), sorted(names))
+        self.assertEqual(len(flat), len(set(flat)))
+        # Singles come before all groups.
+        kinds = [isinstance(entry, list) for entry in result]
+        self.assertEqual(kinds, sorted(kinds))
+
+
+if __name__ == '__main__':
+    unittest.main()
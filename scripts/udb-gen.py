@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+#
+# Single process driver for all UDB -> * translations. The instruction and
+# CSR definitions are loaded once and handed to the emitters of the
+# individual udb-to-*.py scripts.
+#
+# Copyright (c) 2025 rev.ng Labs Srl.
+#
+# This work is licensed under the terms of the GNU GPL, version 2 or
+# (at your option) any later version.
+#
+# See the LICENSE file in the top-level directory for details.
+#
+
+import argparse
+import importlib.util
+import os
+import common
+
+artifacts = ['cpp', 'csr', 'decodetree', 'trans', 'disas', 'klee']
+
+
+def import_script(name):
+    """Import scripts/NAME.py as a module, NAME may contain dashes."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        f'{name}.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='udb-gen.py',
+        description='Generate all QEMU frontend artifacts for an extension \
+                     from the UDB in a single process'
+    )
+    parser.add_argument('--name', required=True,
+                        help='Extension name used to derive output file names, e.g. xqci')
+    parser.add_argument('--inst-dir', required=True,
+                        help='Path to extensions instruction directory in the UDB')
+    parser.add_argument('--csrs', default='',
+                        help='Comma separated list of CSR directories in the UDB which instruction definitions depend on')
+    parser.add_argument('--csr-dir',
+                        help='Path to CSR directory in the UDB of CSRs defined by the extension')
+    parser.add_argument('--disas-sizes', default='16,32',
+                        help='Comma separated list of instruction sizes to decode in the disassembler')
+    parser.add_argument('--helper-to-tcg-translated',
+                        help='Path to output from helper-to-tcg of list of instructions which were successfully translated to TCG')
+    parser.add_argument('--klee-out',
+                        help='Output directory of KLEE input, defaults to OUT_DIR/klee/NAME')
+    parser.add_argument('--out-dir', default='build')
+    parser.add_argument('--artifacts', default=','.join(artifacts[:-1]),
+                        help=f'Comma separated list of artifacts to generate, any of {",".join(artifacts)}')
+    parser.add_argument('--referenced-csrs-only', action='store_true',
+                        help='Only load and emit CSRs referenced by name in instruction operations')
+    parser.add_argument('--cpp-shards', type=int, default=1,
+                        help='Split the helper-to-tcg cpp input into this many translation units, 0 for one per instruction')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes used to parse UDB files')
+    args = parser.parse_args()
+
+    selected = args.artifacts.split(',')
+    for a in selected:
+        if a not in artifacts:
+            parser.error(f'unknown artifact {a}')
+    if 'csr' in selected and not args.csr_dir:
+        parser.error('--csr-dir is required to generate csr')
+
+    print(f'  - loading UDB for {args.name} with {common.yaml_loader_name}')
+    instructions = common.load_instructions(args.inst_dir, args.jobs)
+    csr_dirs = [d for d in args.csrs.split(',') if d]
+    if args.referenced_csrs_only:
+        csrs = common.load_referenced_csrs(csr_dirs, instructions.values(),
+                                           args.jobs)
+    else:
+        csrs = common.load_csrs(csr_dirs, args.jobs)
+
+    out = args.out_dir
+    name = args.name
+
+    if 'cpp' in selected:
+        print(f'  - helper-to-tcg cpp input for {name}')
+        import_script('udb-to-cpp').emit(
+            os.path.join(out, f'{name}.cpp'), instructions, csrs,
+            args.cpp_shards)
+
+    if 'csr' in selected:
+        print(f'  - CSR fields for {name}')
+        # Files also listed in --csrs were already parsed above and are
+        # served from the in-process spec cache.
+        ext_csrs = common.load_csrs([args.csr_dir], args.jobs)
+        import_script('udb-to-csr').emit(
+            os.path.join(out, f'{name}-csr.c'),
+            os.path.join(out, f'{name}-csr.h'), ext_csrs, name)
+
+    if 'decodetree' in selected:
+        print(f'  - QEMU decodetree input for {name}')
+        import_script('udb-to-decodetree').emit(
+            os.path.join(out, name), instructions)
+
+    if 'trans' in selected:
+        print(f'  - QEMU decodetree translation functions for {name}')
+        import_script('udb-to-trans').emit(
+            os.path.join(out, f'{name}-trans-decode.c.inc'),
+            os.path.join(out, f'riscv-{name}-trans-disas.c.inc'),
+            instructions)
+
+    if 'disas' in selected:
+        print(f'  - QEMU disas glue files for {name}')
+        sizes = [int(s) for s in args.disas_sizes.split(',')]
+        import_script('udb-to-disas').emit(
+            os.path.join(out, f'riscv-{name}.c'),
+            os.path.join(out, f'riscv-{name}.h'),
+            instructions, name, sizes, f'riscv-{name}-trans-disas.c.inc')
+
+    if 'klee' in selected:
+        print(f'  - KLEE input for {name}')
+        klee_out = args.klee_out or os.path.join(out, 'klee', name)
+        os.makedirs(klee_out, exist_ok=True)
+        translated = ''
+        if args.helper_to_tcg_translated:
+            with open(args.helper_to_tcg_translated, 'r') as f:
+                translated = f.read()
+        import_script('udb-to-klee').emit(klee_out, instructions, csrs,
+                                         translated, args.referenced_csrs_only)
+
+
+if __name__ == '__main__':
+    main()
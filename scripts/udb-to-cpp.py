@@ -11,7 +11,6 @@
 # See the LICENSE file in the top-level directory for details.
 #
 
-import yaml
 import argparse
 import re
 import subprocess
@@ -80,17 +79,6 @@ def should_translate(name):
     }
 
 
-def get_csrs(exts):
-    csrs = {}
-    for dir in exts.split(','):
-        for file in sorted(os.listdir(dir)):
-            if not file.endswith('.yaml'):
-                continue
-            y = common.load_yaml_or_exit(os.path.join(dir, file))
-            csrs[y['name']] = y
-    return csrs
-
-
 def out_csr(out, csrs):
     for csr in csrs:
         if csr in {'time'}:
@@ -120,6 +108,136 @@ def out_csr(out, csrs):
                 out.write(f"#define {csr_name.upper()}_{field} {hex(mask)}\n")
 
 
+def instruction_params(y):
+    """Return the C++ parameters of the function for instruction Y."""
+    vars = []
+    for v in common.variables(y):
+        s = common.var_size(v)
+        cs = common.bit_to_c_size(s)
+        if common.operands(y)[v['name']].is_imm:
+            vars.append(f'Bits<{s}> ' + v['name'])
+        else:
+            vars.append(f'uint{cs}_t ' + v['name'])
+    return vars
+
+
+def out_instruction(out, y, csrs, scope=''):
+    """Write the helper-to-tcg function for instruction Y to OUT."""
+    vars = instruction_params(y)
+    imm_vars = ', '.join([str(i+1)
+                         for i in range(0, len(vars))])
+    name = y['name']
+    out.write('\n')
+    out.write('__attribute__((used))\n')
+    out.write(
+        f'__attribute__((annotate ("immediate: {imm_vars}")))\n')
+    out.write(
+        '__attribute__((annotate ("helper-to-tcg")))\n')
+    out.write(f"void {scope}{re.sub(r'\.', r'_', name)}({
+              ', '.join(vars)}) {{\n")
+    op = y['operation()']
+    op = common.op_to_cpp(op, csrs)
+    out.write(op)
+    out.write('}\n')
+
+
+def shard_path(out_path, i):
+    return f'{os.path.splitext(out_path)[0]}-shard-{i}.cpp'
+
+
+def split_shards(instructions, count):
+    """
+    Split INSTRUCTIONS into COUNT lists of similar total operation length,
+    each kept in the original order.
+    """
+    shards = [[] for _ in range(count)]
+    sizes = [0] * count
+    order = sorted(range(len(instructions)),
+                   key=lambda i: -len(instructions[i]['operation()']))
+    for i in order:
+        s = sizes.index(min(sizes))
+        shards[s].append(i)
+        sizes[s] += len(instructions[i]['operation()'])
+    return [[instructions[i] for i in sorted(shard)] for shard in shards]
+
+
+def emit(out_path, instructions, csrs, shards=1):
+    """
+    Write helper-to-tcg C++ input for INSTRUCTIONS to OUT_PATH.
+
+    With SHARDS other than 1 the instructions are instead split over SHARDS
+    translation units (one per instruction if 0) next to OUT_PATH, which
+    can be compiled in parallel and joined with llvm-link.
+    """
+    if shards != 1:
+        emit_shards(out_path, instructions, csrs, shards)
+        return
+
+    inputs = common.generator_inputs(__file__, instructions.values(),
+                                     csrs.values())
+    if common.deps.is_up_to_date(out_path, inputs):
+        return
+
+    with common.open_output(out_path) as out:
+        out.write(h2tcg_str_includes)
+
+        out_csr(out, csrs)
+
+        out.write(preamble)
+
+        for file, y in instructions.items():
+            if not should_translate(file):
+                continue
+            out_instruction(out, y, csrs)
+        out.write("};\n")
+        out.write(postamble)
+    common.deps.record(out_path, inputs)
+
+
+def emit_shards(out_path, instructions, csrs, shards):
+    translated = [y for file, y in instructions.items()
+                  if should_translate(file)]
+    count = len(translated) if shards <= 0 else min(shards, len(translated))
+    count = max(count, 1)
+    header_path = f'{os.path.splitext(out_path)[0]}-shared.h'
+    paths = [shard_path(out_path, i) for i in range(count)]
+
+    # Remove shards left over from runs with more of them.
+    i = count
+    while os.path.exists(shard_path(out_path, i)):
+        os.remove(shard_path(out_path, i))
+        i += 1
+
+    inputs = common.generator_inputs(__file__, instructions.values(),
+                                     csrs.values())
+    params = (shards,)
+    if all(common.deps.is_up_to_date(o, inputs, params)
+           for o in [header_path] + paths):
+        return
+
+    with common.open_output(header_path) as out:
+        out.write('#pragma once\n')
+        out.write(h2tcg_str_includes)
+        out_csr(out, csrs)
+        out.write(preamble)
+        for y in translated:
+            out.write(f"    void {re.sub(r'\.', r'_', y['name'])}({
+                      ', '.join(instruction_params(y))});\n")
+        out.write("};\n")
+    common.deps.record(header_path, inputs, params)
+
+    header = os.path.basename(header_path)
+    for i, shard in enumerate(split_shards(translated, count)):
+        with common.open_output(paths[i]) as out:
+            out.write(f'#include "{header}"\n')
+            for y in shard:
+                out_instruction(out, y, csrs, 'CPUArchState::')
+            # The TCG global mappings are only defined once.
+            if i == 0:
+                out.write(postamble)
+        common.deps.record(paths[i], inputs, params)
+
+
 def main():
     parser = argparse.ArgumentParser(
         prog='udb-to-cpp',
@@ -131,52 +249,22 @@ def main():
                         help='Path to extensions instruction directory in the UDB')
     parser.add_argument('--csrs',
                         help='Comma separated list of CSR directories in the UDB which instruction definitions depend on')
+    parser.add_argument('--referenced-csrs-only', action='store_true',
+                        help='Only load and emit CSRs referenced by name in instruction operations')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Split the output into this many translation units OUT-shard-N.cpp sharing OUT-shared.h, 0 for one per instruction')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes used to parse UDB files')
     args = parser.parse_args()
 
-    csrs = get_csrs(args.csrs) if args.csrs else {}
-
-    with open(args.out, 'w') as out:
-        out.write(h2tcg_str_includes)
-
-        out_csr(out, csrs)
-
-        out.write(preamble)
-
-        for file in sorted(os.listdir(args.inst_dir)):
-            if not should_translate(file):
-                continue
-
-            with open(os.path.join(args.inst_dir, file), 'r') as f:
-                try:
-                    y = yaml.safe_load(f)
-                    vars = []
-                    if 'variables' in y['encoding']:
-                        for v in y['encoding']['variables']:
-                            s = common.var_size(v)
-                            cs = common.bit_to_c_size(s)
-                            if common.var_is_imm(y['operation()'], v['name']):
-                                vars.append(f'Bits<{s}> ' + v['name'])
-                            else:
-                                vars.append(f'uint{cs}_t ' + v['name'])
-                    imm_vars = ', '.join([str(i+1)
-                                         for i in range(0, len(vars))])
-                    name = y['name']
-                    out.write('\n')
-                    out.write('__attribute__((used))\n')
-                    out.write(
-                        f'__attribute__((annotate ("immediate: {imm_vars}")))\n')
-                    out.write(
-                        '__attribute__((annotate ("helper-to-tcg")))\n')
-                    out.write(f"void {re.sub(r'\.', r'_', name)}({
-                              ', '.join(vars)}) {{\n")
-                    op = y['operation()']
-                    op = common.op_to_cpp(op, csrs)
-                    out.write(op)
-                    out.write('}\n')
-                except yaml.YAMLError as e:
-                    print(e)
-        out.write("};\n")
-        out.write(postamble)
+    instructions = common.load_instructions(args.inst_dir, args.jobs)
+    csrs = {}
+    if args.csrs and args.referenced_csrs_only:
+        csrs = common.load_referenced_csrs(args.csrs.split(','),
+                                           instructions.values(), args.jobs)
+    elif args.csrs:
+        csrs = common.load_csrs(args.csrs.split(','), args.jobs)
+    emit(args.out, instructions, csrs, args.shards)
 
 
 if __name__ == '__main__':
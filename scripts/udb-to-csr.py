@@ -13,36 +13,21 @@
 
 import common
 import argparse
-import os
 import re
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        prog='udb-to-csr.py',
-        description='Convert UDB descriptions of CSR fields to .c/.h files that can be included in a QEMU RISC-V frontend'
-    )
-    parser.add_argument('--inst-dir', required=True,
-                        help='Path to extensions instruction directory in the UDB')
-    parser.add_argument('--csr-dir', required=True,
-                        help='Path to CSR directory in the UDB')
-    parser.add_argument('--out-c', required=True)
-    parser.add_argument('--out-h', required=True)
-    parser.add_argument('--name', required=True)
-    args = parser.parse_args()
-
-    csrs = {}
-    for file in sorted(os.listdir(args.csr_dir)):
-        if not file.endswith('.yaml'):
-            continue
-        y = common.load_yaml_or_exit(os.path.join(args.csr_dir, file))
-        csrs[y['name']] = y
+def emit(out_c, out_h, csrs, name):
+    """Write QEMU CSR definitions for CSRS to OUT_C/OUT_H."""
+    inputs = common.generator_inputs(__file__, csrs.values())
+    if common.deps.is_up_to_date(out_c, inputs, name) and \
+       common.deps.is_up_to_date(out_h, inputs, name):
+        return
 
-    with open(args.out_c, 'w') as out:
+    with common.open_output(out_c) as out:
         out.write('#include "qemu/osdep.h"\n')
         out.write('#include "cpu.h"\n')
         out.write('#include "cpu_vendorid.h"\n')
-        out.write(f'#include "{args.name}-csr.h"\n')
+        out.write(f'#include "{name}-csr.h"\n')
         out.write('\n')
 
         for csr in csrs:
@@ -89,7 +74,7 @@ def main():
             out.write('    },\n')
         out.write('}\n')
 
-    with open(args.out_h, 'w') as out:
+    with common.open_output(out_h) as out:
         out.write('\n')
         for csr in csrs:
             csr_name = re.sub(r'\.', r'_', csr)
@@ -120,7 +105,30 @@ def main():
                     out.write(f"#define {csr_name.upper()}_{
                               field} {hex(mask)}\n")
 
-        out.write(f'void {args.name}_register_custom_csrs(RISCVCPU *cpu);\n')
+        out.write(f'void {name}_register_custom_csrs(RISCVCPU *cpu);\n')
+
+    common.deps.record(out_c, inputs, name)
+    common.deps.record(out_h, inputs, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='udb-to-csr.py',
+        description='Convert UDB descriptions of CSR fields to .c/.h files that can be included in a QEMU RISC-V frontend'
+    )
+    parser.add_argument('--inst-dir', required=True,
+                        help='Path to extensions instruction directory in the UDB')
+    parser.add_argument('--csr-dir', required=True,
+                        help='Path to CSR directory in the UDB')
+    parser.add_argument('--out-c', required=True)
+    parser.add_argument('--out-h', required=True)
+    parser.add_argument('--name', required=True)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes used to parse UDB files')
+    args = parser.parse_args()
+
+    csrs = common.load_csrs([args.csr_dir], args.jobs)
+    emit(args.out_c, args.out_h, csrs, args.name)
 
 
 if __name__ == '__main__':
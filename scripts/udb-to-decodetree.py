@@ -13,7 +13,8 @@
 
 import common
 import argparse
-import os
+import functools
+import operator
 import re
 
 
@@ -42,26 +43,108 @@ def should_translate(name):
     }
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        prog='udb-to-decodetree.py',
-        description='Convert UDB instruction encodings to QEMU decodetree input'
-    )
-    parser.add_argument('--inst-dir', required=True,
-                        help='Path to extensions instruction directory in the UDB')
-    parser.add_argument('--out', required=True)
-    args = parser.parse_args()
+class DisjointSet:
+    """Union-find over the integers 0..N-1 with path compression and union by rank."""
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+        self.rank = [0] * n
+
+    def find(self, i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i, j):
+        i = self.find(i)
+        j = self.find(j)
+        if i == j:
+            return
+        if self.rank[i] < self.rank[j]:
+            i, j = j, i
+        self.parent[j] = i
+        if self.rank[i] == self.rank[j]:
+            self.rank[i] += 1
+
+    def groups(self):
+        """Return all sets as sorted lists, ordered by their smallest element."""
+        groups = {}
+        for i in range(len(self.parent)):
+            groups.setdefault(self.find(i), []).append(i)
+        return list(groups.values())
+
+
+def fixed_bits(match):
+    """
+    Return (bits, mask) of the fixed bits of the MATCH string, where MASK
+    has a bit set for every 0 or 1 in MATCH and BITS holds their values.
+    """
+    bits = int(match.replace('-', '0'), 2)
+    mask = int(re.sub(r'[01]', '1', match).replace('-', '0'), 2)
+    return bits, mask
+
+
+def overlap_groups(names, matches):
+    """
+    Return the instructions NAMES, of the same size and with encodings
+    MATCHES, in decodetree order: single instructions, then lists of
+    instructions whose fixed bit patterns overlap.
+    """
+    fixed = [fixed_bits(m) for m in matches]
+
+    # Two instructions can only overlap if they agree on the bits fixed
+    # in every instruction (e.g. the opcode), so only compare those
+    # sharing the same value for them.
+    common_mask = functools.reduce(operator.and_, [m for _, m in fixed])
+    buckets = {}
+    for i, (bits, mask) in enumerate(fixed):
+        buckets.setdefault(bits & common_mask, []).append(i)
+
+    # Overlap is not transitive, but all instructions connected by
+    # overlapping pairs have to be placed in the same group.
+    overlaps = DisjointSet(len(names))
+    for bucket in buckets.values():
+        for j, i0 in enumerate(bucket):
+            b0, m0 = fixed[i0]
+            for i1 in bucket[j+1:]:
+                b1, m1 = fixed[i1]
+                if (b0 ^ b1) & m0 & m1 == 0:
+                    overlaps.union(i0, i1)
+
+    # Overlapping instructions are emitted as groups after all
+    # non-overlapping ones. Within a group the first matching pattern
+    # wins, so more specific patterns go first, otherwise spec order
+    # is kept.
+    groups = overlaps.groups()
+    return [names[g[0]] for g in groups if len(g) == 1] + \
+        [[names[i] for i in sorted(g, key=lambda i: -fixed[i][1].bit_count())]
+         for g in groups if len(g) > 1]
+
+
+def emit(out_prefix, instructions):
+    """
+    Write decodetree input for INSTRUCTIONS to OUT_PREFIX-<size>.decode,
+    one file per instruction size.
+    """
+    instructions = {file: y for file, y in instructions.items()
+                    if should_translate(file) or should_decode_only(file)}
+
+    inputs = common.generator_inputs(__file__, instructions.values())
+    outputs = [f'{out_prefix}-{size}.decode'
+               for size in sorted({len(y['encoding']['match'])
+                                   for y in instructions.values()})]
+    if all(common.deps.is_up_to_date(o, inputs) for o in outputs):
+        return
 
     encoding = {}
-    operation = {}
-    for file in sorted(os.listdir(args.inst_dir)):
-        if not should_translate(file) and not should_decode_only(file):
-            continue
-
-        y = common.load_yaml_or_exit(os.path.join(args.inst_dir, file))
+    operands = {}
+    for file, y in instructions.items():
         op_name = re.sub(r'\.', r'_', y['name'])
         encoding[op_name] = y['encoding']
-        operation[op_name] = y['operation()']
+        operands[op_name] = common.operands(y)
 
     # Collect sizes of instructions, and group them by size
     instruction_sizes = {}
@@ -75,49 +158,9 @@ def main():
     # Instructions which are separated by a runtime field need special
     # formatting in the decodetree input.
     for size in instruction_sizes:
-        new_inst = {}
-        overlapping = []
-
-        N = len(instruction_sizes[size])
-        for i0 in range(0, N):
-            n0 = instruction_sizes[size][i0]
-            fixed0 = encoding[n0]['match']
-            p0 = int(re.sub(r'-', r'0', fixed0), 2)
-            for i1 in range(i0+1, N):
-                n1 = instruction_sizes[size][i1]
-                fixed1 = encoding[n1]['match']
-                p1 = int(re.sub(r'-', r'0', fixed1), 2)
-
-                matches = True
-                for j in range(0, size):
-                    rj = size-1 - j
-                    if fixed0[rj] == '1' and fixed1[rj] == '0' or \
-                       fixed0[rj] == '0' and fixed1[rj] == '1':
-                        matches = False
-                        break
-
-                if matches:
-                    inserted = False
-                    for o in overlapping:
-                        if n0 in o:
-                            o.add(n1)
-                            inserted = True
-                            break
-                        if n1 in o:
-                            o.add(n0)
-                            inserted = True
-                            break
-                    if not inserted:
-                        overlapping.append({n0, n1})
-
-                if p0 == p1:
-                    new_name = f'{n0}_{n1}'
-                    new_inst[new_name] = [n0, n1]
-
-        for o in overlapping:
-            for e in o:
-                instruction_sizes[size].remove(e)
-            instruction_sizes[size].append(o)
+        names = instruction_sizes[size]
+        instruction_sizes[size] = overlap_groups(
+            names, [encoding[n]['match'] for n in names])
 
     defs = {}
     formats = {}
@@ -135,7 +178,7 @@ def main():
             if size not in formats:
                 formats[size] = []
 
-            if isinstance(inst, set):
+            if isinstance(inst, list):
                 for i in inst:
                     inst_name = i
 
@@ -175,10 +218,10 @@ def main():
 
     for size in instruction_sizes:
         for inst in instruction_sizes[size]:
-            if isinstance(inst, set):
+            if isinstance(inst, list):
                 continue
 
-            op = operation[inst]
+            inst_operands = operands[inst]
             y = encoding[inst]
             inst_name = inst
 
@@ -215,7 +258,7 @@ def main():
                         start, length = r
 
                         sign_extend = ''
-                        if i == 0 and ('sign_extend' in v or f'$signed({v["name"]})' in op):
+                        if i == 0 and ('sign_extend' in v or inst_operands[v['name']].is_signed):
                             sign_extend = 's'
 
                         start += common.round_to_power_of_two(size) - size
@@ -228,24 +271,42 @@ def main():
 
             formats[size].append(format)
 
-        for pattern_length in defs:
-            with open(f'{args.out}-{pattern_length}.decode', 'w') as out:
-
-                for name in defs[pattern_length]:
-                    out.write(defs[pattern_length][name])
+    for pattern_length in defs:
+        out_path = f'{out_prefix}-{pattern_length}.decode'
+        with common.open_output(out_path) as out:
+            for name in defs[pattern_length]:
+                out.write(defs[pattern_length][name])
+                out.write('\n')
+
+            for f in formats[pattern_length]:
+                if isinstance(f, list):
+                    out.write('{\n')
+                    for subf in f:
+                        out.write('  ')
+                        out.write(subf)
+                        out.write('\n')
+                    out.write('}\n')
+                else:
+                    out.write(f)
                     out.write('\n')
 
-                for f in formats[pattern_length]:
-                    if isinstance(f, list):
-                        out.write('{\n')
-                        for subf in f:
-                            out.write('  ')
-                            out.write(subf)
-                            out.write('\n')
-                        out.write('}\n')
-                    else:
-                        out.write(f)
-                        out.write('\n')
+        common.deps.record(out_path, inputs)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='udb-to-decodetree.py',
+        description='Convert UDB instruction encodings to QEMU decodetree input'
+    )
+    parser.add_argument('--inst-dir', required=True,
+                        help='Path to extensions instruction directory in the UDB')
+    parser.add_argument('--out', required=True)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes used to parse UDB files')
+    args = parser.parse_args()
+
+    instructions = common.load_instructions(args.inst_dir, args.jobs)
+    emit(args.out, instructions)
 
 
 if __name__ == '__main__':
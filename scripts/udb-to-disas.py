@@ -13,7 +13,6 @@
 
 import common
 import argparse
-import os
 import re
 
 
@@ -42,43 +41,34 @@ def should_translate(name):
     }
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        prog='udb-to-trans.py',
-        description='Convert UDB instruction encodings to QEMU decodetree input'
-    )
-    parser.add_argument('--inst-dir', required=True,
-                        help='Path to extensions instruction directory in the UDB')
-    parser.add_argument('--out-c', required=True)
-    parser.add_argument('--out-h', required=True)
-    parser.add_argument('--trans-disas', required=True)
-    parser.add_argument('--disas-name', required=True)
-    parser.add_argument('--disas-sizes', required=True)
-    args = parser.parse_args()
-
-    instructions = {}
-    for file in sorted(os.listdir(args.inst_dir)):
-        if not should_translate(file) and not should_decode_only(file):
-            continue
+def emit(out_c, out_h, instructions, disas_name, sizes, trans_disas):
+    """Write QEMU disassembler glue for INSTRUCTIONS to OUT_C/OUT_H."""
+    instructions = {
+        file: y for file, y in instructions.items()
+        if should_translate(file) or should_decode_only(file)
+    }
 
-        y = common.load_yaml_or_exit(os.path.join(args.inst_dir, file))
-        instructions[y['name']] = y
+    inputs = common.generator_inputs(__file__, instructions.values())
+    params = (disas_name, sizes, trans_disas)
+    if common.deps.is_up_to_date(out_c, inputs, params) and \
+       common.deps.is_up_to_date(out_h, inputs, params):
+        return
 
-    with open(f'{args.out_h}', 'w') as out:
-        out.write(f'#ifndef DISAS_RISCV_{args.disas_name.upper()}_H\n')
-        out.write(f'#define DISAS_RISCV_{args.disas_name.upper()}_H\n')
+    with common.open_output(out_h) as out:
+        out.write(f'#ifndef DISAS_RISCV_{disas_name.upper()}_H\n')
+        out.write(f'#define DISAS_RISCV_{disas_name.upper()}_H\n')
         out.write('\n')
         out.write(f'extern const rv_opcode_data {
-                  args.disas_name}_opcode_data[];\n')
-        out.write(f'void decode_{args.disas_name}(rv_decode *, rv_isa);\n')
+                  disas_name}_opcode_data[];\n')
+        out.write(f'void decode_{disas_name}(rv_decode *, rv_isa);\n')
         out.write('\n')
         out.write('#endif\n')
 
-    with open(f'{args.out_c}', 'w') as out:
+    with common.open_output(out_c) as out:
         out.write('#include \"qemu/osdep.h\"\n')
         out.write('#include \"qemu/bitops.h\"\n')
         out.write('#include \"disas/riscv.h\"\n')
-        out.write(f'#include \"disas/riscv-{args.disas_name}.h\"\n')
+        out.write(f'#include \"disas/riscv-{disas_name}.h\"\n')
         out.write('\n')
 
         out.write('typedef enum {\n')
@@ -91,11 +81,11 @@ def main():
                 out.write(f'    rv_op_{op_name} = 1,\n')
             else:
                 out.write(f'    rv_op_{op_name},\n')
-        out.write(f'}} rv_{args.disas_name}_opcode;\n')
+        out.write(f'}} rv_{disas_name}_opcode;\n')
         out.write('\n')
 
         out.write(f'const rv_opcode_data {
-                  args.disas_name}_opcode_data[] = {{\n')
+                  disas_name}_opcode_data[] = {{\n')
         out.write(
             '    { "qc.illegal", rv_codec_illegal, rv_fmt_none, NULL, 0, 0, 0 },\n')
         for inst in instructions:
@@ -141,12 +131,10 @@ def main():
 
         out.write("\n")
 
-        sizes = [int(s) for s in args.disas_sizes.split(',')]
-
         for s in sizes:
             if s == 16 or s == 32:
                 continue
-            out.write(f'static uint64_t decode_{args.disas_name}_{
+            out.write(f'static uint64_t decode_{disas_name}_{
                       s}_impl_load_bytes(rv_decode *dec, uint64_t insn, int offset, int length)\n')
             out.write('{\n')
             out.write('    return 0;\n')
@@ -157,14 +145,14 @@ def main():
             if non_standard_size:
                 out.write('#pragma GCC diagnostic push\n')
                 out.write('#pragma GCC diagnostic ignored "-Wunused-function"\n')
-            out.write(f'#include "riscv-{args.disas_name}-{s}-decode.c.inc"\n')
+            out.write(f'#include "riscv-{disas_name}-{s}-decode.c.inc"\n')
             if non_standard_size:
                 out.write('#pragma GCC diagnostic pop\n')
-        out.write(f'#include "{args.trans_disas}"\n')
+        out.write(f'#include "{trans_disas}"\n')
         out.write('\n')
 
         out.write(f'void decode_{
-                  args.disas_name}(rv_decode *dec, rv_isa isa) {{\n')
+                  disas_name}(rv_decode *dec, rv_isa isa) {{\n')
         out.write('    rv_inst inst = dec->inst;\n')
         out.write('    dec->op = rv_op_illegal;\n')
         out.write('    switch (dec->inst_length) {\n')
@@ -172,12 +160,37 @@ def main():
             out.write(f'    case {int(s/8)}:\n')
             if s == 48:
                 out.write(f'        inst <<= (64-48);\n')
-            out.write(f'        decode_{args.disas_name}_{
+            out.write(f'        decode_{disas_name}_{
                       s}_impl(dec, inst);\n')
             out.write('        break;\n')
         out.write('    }\n')
         out.write('}\n')
 
+    common.deps.record(out_c, inputs, params)
+    common.deps.record(out_h, inputs, params)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='udb-to-trans.py',
+        description='Convert UDB instruction encodings to QEMU decodetree input'
+    )
+    parser.add_argument('--inst-dir', required=True,
+                        help='Path to extensions instruction directory in the UDB')
+    parser.add_argument('--out-c', required=True)
+    parser.add_argument('--out-h', required=True)
+    parser.add_argument('--trans-disas', required=True)
+    parser.add_argument('--disas-name', required=True)
+    parser.add_argument('--disas-sizes', required=True)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes used to parse UDB files')
+    args = parser.parse_args()
+
+    instructions = common.load_instructions(args.inst_dir, args.jobs)
+    sizes = [int(s) for s in args.disas_sizes.split(',')]
+    emit(args.out_c, args.out_h, instructions, args.disas_name, sizes,
+         args.trans_disas)
+
 
 if __name__ == '__main__':
     main()
@@ -11,7 +11,6 @@
 # See the LICENSE file in the top-level directory for details.
 #
 
-import yaml
 import argparse
 import re
 import os
@@ -67,17 +66,6 @@ def should_translate(name):
     }
 
 
-def get_csrs(exts):
-    csrs = {}
-    for dir in exts.split(','):
-        for file in sorted(os.listdir(dir)):
-            if not file.endswith('.yaml'):
-                continue
-            y = common.load_yaml_or_exit(os.path.join(dir, file))
-            csrs[y['name']] = y
-    return csrs
-
-
 def out_csr(out, csrs):
     for csr in csrs:
         if csr in {'time'}:
@@ -107,6 +95,197 @@ def out_csr(out, csrs):
                 out.write(f"#define {csr_name.upper()}_{field} {hex(mask)}\n")
 
 
+def emit_instruction(out, y, csrs):
+    """Write KLEE C++ input for the single instruction Y to OUT."""
+    name = y['name']
+    op_name = re.sub(r'\.', r'_', name)
+    out.write('#include <klee/klee.h>\n')
+    out.write(f'#define INST_SIZE {
+              int(len(y['encoding']['match'])/8)}')
+    out.write(klee_str_includes)
+
+    out_csr(out, csrs)
+
+    out.write(preamble)
+
+    operands = common.operands(y)
+    vars = []
+    var_names = []
+    if 'variables' in y['encoding']:
+        for v in y['encoding']['variables']:
+            s = common.var_size(v)
+            cs = common.bit_to_c_size(s)
+            if operands[v['name']].is_imm:
+                vars.append(f'Bits<{s}> ' + v['name'])
+            else:
+                vars.append(f'uint{cs}_t ' + v['name'])
+            var_names.append(v['name'])
+    out.write('\n')
+
+    out.write(f"void {re.sub(r'\.', r'_', name)
+                      }({', '.join(vars)}) {{\n")
+    op = y['operation()']
+    op = common.op_to_cpp(op, csrs, True)
+    out.write(op)
+    out.write('}\n')
+
+    out.write("};\n")
+
+    out.write('static void run_test() {\n')
+    out.write('CPUArchState cpu;\n')
+    out.write('for (int i = 0; i < 32; ++i) {\n')
+    out.write('    cpu.X[i] = 0;\n')
+    out.write('}\n')
+    out.write('cpu.X[2] = 0x2800;\n')
+    call_args = []
+    variables = common.variables(y)
+    print_info = {}
+    for i, v in enumerate(variables):
+        name = v['name']
+
+        is_imm = operands[name].is_imm
+
+        var_size = common.var_size(v) if is_imm else 32
+        cs = common.bit_to_c_size(var_size) if is_imm else 32
+
+        if is_imm:
+            imm_name = f'imm_{name}'
+            out.write(f'uint{cs}_t {imm_name};\n')
+            out.write(
+                f'make_symbolic(&{imm_name}, sizeof({imm_name}), "{imm_name}");\n')
+            if 'sign_extend' in v or operands[name].is_signed:
+                out.write(f"{imm_name} = sextract{
+                          cs}({imm_name}, 0, {var_size});\n")
+            if 'left_shift' in v:
+                out.write(f"{imm_name} <<= {v['left_shift']};\n")
+            out.write(f'Bits<{var_size}> {name}({imm_name});\n')
+            print_info[name] = ('imm', 0, False)
+            call_args.append(name)
+
+        elif 'rd' not in name:
+            out.write(f'uint{cs}_t {name};\n')
+            out.write(
+                f'make_symbolic(&{name}, sizeof({name}), "{name}");\n')
+            compressed_offset = 8 if operands[name].is_compressed else 0
+            offset = i+1+compressed_offset
+            print_info[name] = ('reg', offset, False)
+            out.write(f'cpu.X[{offset}] = {name};\n')
+            call_args.append(str(i+1))
+
+        else:
+            out.write(f'uint{cs}_t {name};\n')
+            out.write(
+                f'make_symbolic(&{name}, sizeof({name}), "{name}");\n')
+            compressed_offset = 8 if operands[name].is_compressed else 0
+            offset = i+1+compressed_offset
+            print_info[name] = ('reg', offset, True)
+            out.write(f'cpu.X[{offset}] = {name};\n')
+            call_args.append(str(i+1))
+
+        if 'not' in v:
+            not_strs = []
+            not_values = v['not'] if isinstance(
+                v['not'], list) else [v['not']]
+            for n in not_values:
+                not_strs.append(f'({name} != {n})')
+            out.write(f'klee_assume({" && ".join(not_strs)});\n')
+
+    for i, v in enumerate(variables):
+        name = v['name']
+        is_imm = operands[name].is_imm
+        var_size = common.var_size(v) if is_imm else 32
+        if var_size < 32 or var_size > 32 and var_size < 64:
+            out.write(
+                f'klee_assume({name} <= ((1ul << {var_size})-1));\n')
+
+    out.write(f"cpu.{op_name}({', '.join(call_args)}")
+    out.write(');\n')
+
+    # Each test is printed as one line of JSON, see
+    # common.read_test_vectors().
+    fields = []
+    args = []
+    for name in print_info:
+        kind, offset, is_output = print_info[name]
+        if kind == 'reg':
+            args.append(name)
+        elif kind == 'imm':
+            args.append(f'{name}.value()')
+        else:
+            assert (False)
+        field = f'{{\\"name\\": \\"{name}\\", \\"in\\": %u'
+        if is_output and kind == 'reg':
+            field += ', \\"out\\": %u'
+            args.append(f'cpu.X[{offset}].value()')
+        fields.append(field + '}')
+    variables = f'[{", ".join(fields)}]' if fields else 'null'
+    out.write(f'printf("{{\\"variables\\": {variables}"{
+              "".join(", " + a for a in args)});\n')
+    out.write('printf(", \\"overflow\\": %u, \\"underflow\\": %u", overflow, underflow);\n')
+    out.write('if (has_jump) {\n')
+    out.write(
+        '    printf(", \\"has_jump\\": {\\"valid_test_jump\\": %u, \\"jump_pc_offset\\": %u}",\n'
+        '           has_valid_test_jump, jump_pc_offset);\n')
+    out.write('}\n')
+    out.write('if (has_load) {\n')
+    out.write(
+        '    printf(", \\"has_valid_test_memop\\": %u, \\"has_load\\": ", has_valid_test_memop);\n')
+    out.write('    print_memory_ops(rmemory);\n')
+    out.write('}\n')
+    out.write('if (has_store) {\n')
+    out.write(
+        '    printf(", \\"has_valid_test_memop\\": %u, \\"has_store\\": ", has_valid_test_memop);\n')
+    out.write('    print_memory_ops(wmemory);\n')
+    out.write('}\n')
+    out.write('printf("}\\n");\n')
+    out.write('}\n')
+
+    # Test executables replay all tests of the instruction, see
+    # klee-replay.h.
+    out.write('int main(int argc, char **argv) {\n')
+    out.write('#ifdef KLEE_REPLAY\n')
+    out.write(
+        f'return replay_main(argc, argv, run_test, "{y["name"]}");\n')
+    out.write('#else\n')
+    out.write('run_test();\n')
+    out.write('return 0;\n')
+    out.write('#endif\n')
+    out.write('}\n')
+
+
+def emit(out_dir, instructions, csrs, translated='',
+         referenced_csrs_only=False):
+    """
+    Write one KLEE C++ input file per instruction to OUT_DIR. If TRANSLATED
+    is non-empty, only instructions it mentions are emitted. With
+    REFERENCED_CSRS_ONLY each file only defines the CSRs its instruction
+    references.
+    """
+    for file, y in instructions.items():
+        if not should_translate(file):
+            continue
+
+        op_name = re.sub(r'\.', r'_', y['name'])
+        if len(translated) > 0 and not op_name in translated:
+            continue
+
+        inst_csrs = csrs
+        if referenced_csrs_only:
+            names = common.referenced_csrs([y])
+            inst_csrs = {n: c for n, c in csrs.items() if n in names}
+
+        # Each file only depends on its own instruction, so unchanged
+        # instructions are skipped entirely.
+        klee_file = os.path.join(out_dir, os.path.splitext(file)[0]) + '.cpp'
+        inputs = common.generator_inputs(__file__, [y], inst_csrs.values())
+        if common.deps.is_up_to_date(klee_file, inputs):
+            continue
+
+        with common.open_output(klee_file) as out:
+            emit_instruction(out, y, inst_csrs)
+        common.deps.record(klee_file, inputs)
+
+
 def main():
     parser = argparse.ArgumentParser(
         prog='udb-to-klee',
@@ -120,187 +299,25 @@ def main():
                         help='Comma separated list of CSR directories in the UDB which instruction definitions depend on')
     parser.add_argument('--helper-to-tcg-translated',
                         help='Path to output from helper-to-tcg of list of instructions which were successfully translated to TCG')
+    parser.add_argument('--referenced-csrs-only', action='store_true',
+                        help='Only load and emit CSRs referenced by name in instruction operations')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes used to parse UDB files')
     args = parser.parse_args()
 
-    csrs = get_csrs(args.csrs)
+    instructions = common.load_instructions(args.inst_dir, args.jobs)
+    if args.referenced_csrs_only:
+        csrs = common.load_referenced_csrs(args.csrs.split(','),
+                                           instructions.values(), args.jobs)
+    else:
+        csrs = common.load_csrs(args.csrs.split(','), args.jobs)
 
     translated = ''
     with open(args.helper_to_tcg_translated, 'r') as f:
         translated = f.read()
 
-    for file in sorted(os.listdir(args.inst_dir)):
-        if not should_translate(file):
-            continue
+    emit(args.out, instructions, csrs, translated, args.referenced_csrs_only)
 
-        klee_file = os.path.join(args.out, os.path.splitext(file)[0]) + '.cpp'
-        with open(os.path.join(args.inst_dir, file), 'r') as f:
-
-            y = None
-            try:
-                y = yaml.safe_load(f)
-            except yaml.YAMLError as e:
-                print(f'Error: {e}')
-                continue
-            name = y['name']
-            op_name = re.sub(r'\.', r'_', name)
-            if len(translated) > 0 and not op_name in translated:
-                continue
-
-            with open(klee_file, 'w') as out:
-                out.write('#include <klee/klee.h>\n')
-                out.write(f'#define INST_SIZE {
-                          int(len(y['encoding']['match'])/8)}')
-                out.write(klee_str_includes)
-
-                out_csr(out, csrs)
-
-                out.write(preamble)
-
-                vars = []
-                var_names = []
-                if 'variables' in y['encoding']:
-                    for v in y['encoding']['variables']:
-                        s = common.var_size(v)
-                        cs = common.bit_to_c_size(s)
-                        if common.var_is_imm(y['operation()'], v['name']):
-                            vars.append(f'Bits<{s}> ' + v['name'])
-                        else:
-                            vars.append(f'uint{cs}_t ' + v['name'])
-                        var_names.append(v['name'])
-                out.write('\n')
-
-                out.write(f"void {re.sub(r'\.', r'_', name)
-                                  }({', '.join(vars)}) {{\n")
-                op = y['operation()']
-                op = common.op_to_cpp(op, csrs, True)
-                out.write(op)
-                out.write('}\n')
-
-                out.write("};\n")
-
-                out.write('int main() {\n')
-                out.write('CPUArchState cpu;\n')
-                out.write('for (int i = 0; i < 32; ++i) {\n')
-                out.write('    cpu.X[i] = 0;\n')
-                out.write('}\n')
-                out.write('cpu.X[2] = 0x2800;\n')
-                call_args = []
-                variables = common.variables(y)
-                print_info = {}
-                op = y['operation()']
-                for i, v in enumerate(variables):
-                    name = v['name']
-
-                    is_imm = common.var_is_imm(op, name)
-
-                    var_size = common.var_size(v) if is_imm else 32
-                    cs = common.bit_to_c_size(var_size) if is_imm else 32
-
-                    if is_imm:
-                        imm_name = f'imm_{name}'
-                        out.write(f'uint{cs}_t {imm_name};\n')
-                        out.write(
-                            f'klee_make_symbolic(&{imm_name}, sizeof({imm_name}), "{imm_name}");\n')
-                        if 'sign_extend' in v or f'$signed({v["name"]})' in op:
-                            out.write(f"{imm_name} = sextract{
-                                      cs}({imm_name}, 0, {var_size});\n")
-                        if 'left_shift' in v:
-                            out.write(f"{imm_name} <<= {v['left_shift']};\n")
-                        out.write(f'Bits<{var_size}> {name}({imm_name});\n')
-                        print_info[name] = ('imm', 0, False)
-                        call_args.append(name)
-
-                    elif 'rd' not in name:
-                        out.write(f'uint{cs}_t {name};\n')
-                        out.write(
-                            f'klee_make_symbolic(&{name}, sizeof({name}), "{name}");\n')
-                        compressed_offset = 8 if common.var_is_compressed(
-                            op, name) else 0
-                        offset = i+1+compressed_offset
-                        print_info[name] = ('reg', offset, False)
-                        out.write(f'cpu.X[{offset}] = {name};\n')
-                        call_args.append(str(i+1))
-
-                    else:
-                        out.write(f'uint{cs}_t {name};\n')
-                        out.write(
-                            f'klee_make_symbolic(&{name}, sizeof({name}), "{name}");\n')
-                        compressed_offset = 8 if common.var_is_compressed(
-                            op, name) else 0
-                        offset = i+1+compressed_offset
-                        print_info[name] = ('reg', offset, True)
-                        out.write(f'cpu.X[{offset}] = {name};\n')
-                        call_args.append(str(i+1))
-
-                    if 'not' in v:
-                        not_strs = []
-                        not_values = v['not'] if isinstance(
-                            v['not'], list) else [v['not']]
-                        for n in not_values:
-                            not_strs.append(f'({name} != {n})')
-                        out.write(f'klee_assume({" && ".join(not_strs)});\n')
-
-                for i, v in enumerate(variables):
-                    name = v['name']
-                    is_imm = common.var_is_imm(y['operation()'], name)
-                    var_size = common.var_size(v) if is_imm else 32
-                    if var_size < 32 or var_size > 32 and var_size < 64:
-                        out.write(
-                            f'klee_assume({name} <= ((1ul << {var_size})-1));\n')
-
-                out.write(f"cpu.{op_name}({', '.join(call_args)}")
-                out.write(');\n')
-
-                out.write('printf("- variables:\\n");\n')
-                for name in print_info:
-                    kind, offset, is_output = print_info[name]
-                    out.write(f'printf("  - name: \\\"{name}\\\"\\n");\n')
-                    if kind == 'reg':
-                        out.write(f'printf("    in: %u\\n", {name});\n')
-                    elif kind == 'imm':
-                        out.write(
-                            f'printf("    in: %u\\n", {name}.value());\n')
-                    else:
-                        assert (False)
-
-                    if is_output and kind == 'reg':
-                        out.write(
-                            f'printf("    out: %u\\n", cpu.X[{offset}].value());\n')
-
-                out.write('printf("  overflow: %u\\n", overflow);\n')
-                out.write('printf("  underflow: %u\\n", underflow);\n')
-                out.write('if (has_jump) {\n')
-                out.write('    printf("  has_jump:\\n");\n')
-                out.write(
-                    '    printf("    valid_test_jump: %u\\n", has_valid_test_jump);\n')
-                out.write(
-                    '    printf("    jump_pc_offset: %u\\n", jump_pc_offset);\n')
-                out.write('}\n')
-                out.write('if (has_load) {\n')
-                out.write(
-                    '    printf("  has_valid_test_memop: %u\\n", has_valid_test_memop);\n')
-                out.write('    printf("  has_load:\\n");\n')
-                out.write('    for (auto &P : rmemory) {\n')
-                out.write('        printf("  - address: %u\\n", P.first);\n')
-                out.write(
-                    '        printf("    value: %u\\n", P.second.value);\n')
-                out.write('        printf("    size: %u\\n", P.second.size);\n')
-                out.write('    }\n')
-                out.write('}\n')
-                out.write('if (has_store) {\n')
-                out.write(
-                    '    printf("  has_valid_test_memop: %u\\n", has_valid_test_memop);\n')
-                out.write('    printf("  has_store:\\n");\n')
-                out.write('    for (auto &P : wmemory) {\n')
-                out.write('        printf("  - address: %u\\n", P.first);\n')
-                out.write(
-                    '        printf("    value: %u\\n", P.second.value);\n')
-                out.write('        printf("    size: %u\\n", P.second.size);\n')
-                out.write('    }\n')
-                out.write('}\n')
-                out.write("return 0;\n")
-                out.write('}\n')
-                out.flush()
 
 
 if __name__ == '__main__':
@@ -13,7 +13,6 @@
 
 import common
 import argparse
-import os
 import re
 
 
@@ -42,28 +41,20 @@ def should_translate(name):
     }
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        prog='udb-to-trans.py',
-        description='Convert UDB instruction encodings to QEMU decodetree input'
-    )
-    parser.add_argument('--inst-dir', required=True,
-                        help='Path to extensions instruction directory in the UDB')
-    parser.add_argument('--out-disas', required=True)
-    parser.add_argument('--out-decode', required=True)
-    args = parser.parse_args()
-
-    instructions = {}
-    for file in sorted(os.listdir(args.inst_dir)):
-        if not should_translate(file) and not should_decode_only(file):
-            continue
+def emit(out_decode, out_disas, instructions):
+    """Write QEMU decode and disassembly trans_*() functions for INSTRUCTIONS."""
+    instructions = {
+        file: y for file, y in instructions.items()
+        if should_translate(file) or should_decode_only(file)
+    }
 
-        y = common.load_yaml_or_exit(os.path.join(args.inst_dir, file))
-        instructions[y['name']] = y
+    inputs = common.generator_inputs(__file__, instructions.values())
+    if common.deps.is_up_to_date(out_decode, inputs) and \
+       common.deps.is_up_to_date(out_disas, inputs):
+        return
 
-    with open(args.out_decode, 'w') as out:
-        for inst in instructions:
-            y = instructions[inst]
+    with common.open_output(out_decode) as out:
+        for file, y in instructions.items():
             name = y['name']
             op_name = re.sub(r'\.', r'_', name)
             out.write(f'static bool trans_{
@@ -126,9 +117,8 @@ def main():
 
             out.write('}\n')
 
-    with open(args.out_disas, 'w') as out:
-        for inst in instructions:
-            y = instructions[inst]
+    with common.open_output(out_disas) as out:
+        for file, y in instructions.items():
             name = y['name']
             op_name = re.sub(r'\.', r'_', name)
             out.write(f'static bool trans_{
@@ -202,6 +192,26 @@ def main():
 
             out.write('}\n')
 
+    common.deps.record(out_decode, inputs)
+    common.deps.record(out_disas, inputs)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='udb-to-trans.py',
+        description='Convert UDB instruction encodings to QEMU decodetree input'
+    )
+    parser.add_argument('--inst-dir', required=True,
+                        help='Path to extensions instruction directory in the UDB')
+    parser.add_argument('--out-disas', required=True)
+    parser.add_argument('--out-decode', required=True)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes used to parse UDB files')
+    args = parser.parse_args()
+
+    instructions = common.load_instructions(args.inst_dir, args.jobs)
+    emit(args.out_decode, args.out_disas, instructions)
+
 
 if __name__ == '__main__':
     main()